@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import logging
+import math
+import time
+
+import metrics
+
+log = logging.getLogger()
+
+# Added to the limit over one limit's worth of successful requests
+INCREASE = 1.0
+# Factor applied on HTTP 429/5xx, connection errors and throttling error codes
+DECREASE = 0.5
+# A request this many times slower than the fastest recent one counts as the service slowing down ...
+LATENCY_TOLERANCE = 2.0
+# ... and at least this many seconds slower, so scheduling noise on fast responses doesn't count ...
+LATENCY_SLACK = 0.1
+# ... which only shrinks the limit a little
+LATENCY_DECREASE = 0.9
+# How fast the latency baseline forgets a fast response, per request
+BASELINE_DRIFT = 1.01
+# Seconds between two decreases, so one burst of errors only counts once
+COOLDOWN = 1.0
+
+
+class AdaptiveLimit:
+    """An asyncio semaphore whose size follows the responses it lets through, additive increase and multiplicative
+    decrease style.
+
+    Every successful request grows the limit by ``INCREASE / limit`` up to ``maximum``; throttling and errors halve
+    it, a request much slower than the per-operation baseline takes 10% off. With ``adaptive=False`` it is a plain
+    semaphore of size ``limit``.
+    """
+
+    def __init__(self, name: str, limit: int, maximum: int = None, minimum: int = 1, adaptive: bool = True):
+        self.name = name
+        self.initial = limit
+        self.limit = float(max(minimum, limit))
+        self.minimum = minimum
+        self.maximum = max(self.limit, maximum or limit)
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.baselines = {}
+        self.last_decrease = -math.inf
+        self.backoffs = 0
+        self.publish()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    async def acquire(self):
+        if not self.waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                # wake() drops cancelled waiters it comes across
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                self.wake()
+            else:
+                # Cancelled after the slot was handed over
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def succeeded(self, latency: float, operation: str = None):
+        if not self.adaptive:
+            return
+
+        baseline = self.baselines.get(operation)
+        baseline = latency if baseline is None else min(latency, baseline * BASELINE_DRIFT)
+        self.baselines[operation] = baseline
+
+        if latency > baseline * LATENCY_TOLERANCE + LATENCY_SLACK:
+            self.decrease("latency", LATENCY_DECREASE)
+        elif self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + INCREASE / self.limit)
+            self.publish()
+            self.wake()
+
+    def throttled(self, reason: str):
+        if self.adaptive:
+            self.decrease(reason, DECREASE)
+
+    def decrease(self, reason: str, factor: float):
+        now = time.monotonic()
+        if now - self.last_decrease < COOLDOWN:
+            return
+
+        self.last_decrease = now
+        previous = self.limit
+        self.limit = max(self.minimum, self.limit * factor)
+        self.backoffs += 1
+        metrics.inc("backoffs", limit=self.name, reason=reason)
+        self.publish()
+        log.info("Requests in flight for %s: %d -> %d (%s)", self.name, previous, self.limit, reason)
+
+    def publish(self):
+        metrics.set_gauge("request_limit", int(self.limit), limit=self.name)
+
+    def status(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "backoffs": self.backoffs,
+        }
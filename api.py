@@ -1,11 +1,29 @@
 import httpx
 import json
 import asyncio
+import email.utils
+import os
+import random
 import re
+import time
 import logging
+import contextvars
+import weakref
+import hashlib
+import itertools
+import math
 import http.cookiejar as cookiejar
+import metrics
+from adaptive import AdaptiveLimit
+from models import Eligibility, Item, parse_time
+from offer_cache import OfferCache
+from code_store import CodeStore
+from filter_rules import FilterRules
+from json_stream import JsonStream, ANY
+from ledger import Ledger, is_settled, CLAIMED, SKIPPED_PUBLISHER, NEEDS_LINK, CODE_RETRIEVED, DONE, CODE_PENDING
 
 gql_url = "https://gaming.amazon.com/graphql"
+home_url = "https://gaming.amazon.com/home"
 
 logging.getLogger("httpx").setLevel(logging.WARNING)
 log = logging.getLogger()
@@ -14,76 +32,147 @@ RED = '\033[91m'
 BLUE = '\033[94m'
 CYAN = '\033[96m'
 MAGENTA = '\033[95m'
-GREEN = '\033[92m'
-RESET = '\033[0m'
 
+# Colours travel with the record (extra=...) and are only applied by the console formatter
+RED_LOG = {"color": RED}
+BLUE_LOG = {"color": BLUE}
+CYAN_LOG = {"color": CYAN}
+MAGENTA_LOG = {"color": MAGENTA}
+
+item_log_buffer = contextvars.ContextVar("item_log_buffer", default=None)
+
+
+def buffer_item_logs(record: logging.LogRecord) -> bool:
+    # Hold back records emitted while an item is being processed so concurrent items don't interleave
+    buffer = item_log_buffer.get()
+    if buffer is None:
+        return True
+    buffer.append(record)
+    return False
+
+
+log.addFilter(buffer_item_logs)
+
+current_account = contextvars.ContextVar("current_account", default="")
+
+# Account names are only shown in the log when more than one account is looted
+multiple_accounts = False
+
+
+def tag_account(record: logging.LogRecord) -> bool:
+    # Runs where the record is created, the account is only known there; lets the output show it
+    account = current_account.get()
+    record.account = account or None
+    record.account_prefix = f"[{account}] " if account and multiple_accounts else ""
+    return True
+
+
+# Titles that are never claimed, on top of the !title: rules in publishers.txt
 blacklist = [
     "Fallout - Season 1",
     "Prime 2024 Teasers",
     "Celebrate Prime Day",
 ]
 
-list_payload = {
-    "operationName": "OffersContext_Offers_And_Items",
-    "variables": {"pageSize": 999},
-    "extensions": {},
-    "query": """
-      query OffersContext_Offers_And_Items($dateOverride: Time, $pageSize: Int) {
-        inGameLoot: items(collectionType: LOOT, dateOverride: $dateOverride, pageSize: $pageSize) {
-          items {
-            ...Item
-            __typename
-          }
-          __typename
-        }
-        expiring: items(collectionType: EXPIRING, dateOverride: $dateOverride) {
-          items {
-            ...Item
-            __typename
-          }
-          __typename
-        }
-        popular: items(collectionType: FEATURED, dateOverride: $dateOverride) {
+
+class BodyTemplate:
+    """A GraphQL request serialized to bytes once.
+
+    Variables given as ``...`` are filled in per call by ``render`` without re-encoding the query.
+    """
+
+    def __init__(self, operation_name: str, query: str, variables: dict, label: str = None):
+        self.label = label or operation_name
+        self.names = [name for name, value in variables.items() if value is ...]
+        self.operation_name = operation_name
+        self.query = query
+        self.variables = variables
+        self.batches = {}
+
+        # Every per-call variable becomes a unique marker, the encoded body is cut into static chunks around them
+        markers = {name: f"\0{name}\0" for name in self.names}
+        encoded = json.dumps(
+            {
+                "operationName": operation_name,
+                "variables": {name: markers.get(name, value) for name, value in variables.items()},
+                "extensions": {},
+                "query": " ".join(query.split()),
+            },
+            separators=(",", ":"),
+        )
+
+        self.chunks = []
+        for name in self.names:
+            marker = json.dumps(markers[name])
+            head, encoded = encoded.split(marker, 1)
+            self.chunks.append(head.encode())
+        self.chunks.append(encoded.encode())
+
+    def render(self, **variables) -> bytes:
+        parts = [self.chunks[0]]
+        for name, chunk in zip(self.names, self.chunks[1:]):
+            parts.append(json.dumps(variables[name], separators=(",", ":")).encode())
+            parts.append(chunk)
+        return b"".join(parts)
+
+    @property
+    def field(self) -> str:
+        # The top-level field the operation selects, where a single response carries its result
+        return re.search(r"\{\s*(\w+)", self.query).group(1)
+
+    def batch(self, count: int) -> "BodyTemplate":
+        """The same operation aliased ``count`` times (b0, b1, ...) in one request, each with its own variables.
+
+        Only for operations with a single top-level field and no fragments; variable ``name`` becomes ``name<i>``.
+        """
+        template = self.batches.get(count)
+        if template is not None:
+            return template
+
+        head, _, body = self.query.partition("{")
+        keyword, _, declarations = head.partition("(")
+        declarations = declarations.strip().rstrip(")")
+        body = body.strip()[:-1]
+
+        def rename(text: str, index: int) -> str:
+            return re.sub(r"\$(\w+)", rf"$\g<1>{index}", text)
+
+        query = (
+            f"{keyword.strip()}({', '.join(rename(declarations, i) for i in range(count))}) {{"
+            + " ".join(f"b{i}: {rename(body, i)}" for i in range(count))
+            + "}"
+        )
+        variables = {f"{name}{i}": value for i in range(count) for name, value in self.variables.items()}
+        template = self.batches[count] = BodyTemplate(self.operation_name, query, variables, f"{self.label}:batch")
+        return template
+
+
+# One page of one collection; LOOT and FREE_GAMES are listed concurrently and page by page
+list_body = BodyTemplate(
+    "OffersContext_Offers_And_Items",
+    """
+      query OffersContext_Offers_And_Items(
+        $collectionType: CollectionType, $dateOverride: Time, $pageSize: Int, $after: String
+      ) {
+        items(collectionType: $collectionType, dateOverride: $dateOverride, pageSize: $pageSize, after: $after) {
           items {
             ...Item
-            __typename
           }
-          __typename
-        }
-        games: items(collectionType: FREE_GAMES, dateOverride: $dateOverride, pageSize: $pageSize) {
-          items {
-            ...Item
-            __typename
+          pageInfo {
+            hasNextPage
+            endCursor
           }
-          __typename
         }
       }
 
       fragment Item on Item {
         id
-        isFGWP
-        isDirectEntitlement
-        isRetailLinkItem
         grantsCode
         priority
-        pixels {
-          ...Pixel
-          __typename
-        }
         assets {
           id
           title
           externalClaimLink
-          cardMedia {
-            defaultMedia {
-              src1x
-              src2x
-              type
-              __typename
-            }
-            __typename
-          }
-          __typename
         }
         offers {
           id
@@ -93,135 +182,591 @@ list_payload = {
             eligibility {
               offerState
               isClaimed
-              conflictingClaimAccount {
-                obfuscatedEmail
-                __typename
-              }
-              __typename
             }
-            __typename
           }
-          __typename
         }
         game {
           id
-          isActiveAndVisible
           assets {
             title
-            __typename
           }
-          __typename
         }
-        __typename
-      }
-      
-      fragment Pixel on Pixel {
-        type
-        pixel
-        __typename
       }
     """,
-}
+    {"collectionType": ..., "pageSize": 100, "after": ...},
+)
 
-user_payload = {
-    "operationName": "Entry_Points_User",
-    "extensions": {},
-    "variables": {"weblabTreatmentList": [
-      "PG_326549",
-      "PG_TO_THE_MOON_372912",
-      "PG_CHEESY_GORDITA_439922",
-      "PG_CLAIM_CONSOLIDATION_MILESTONE_3_582648",
-      "PG_SCRAMBLED_EGGS_446919",
-      "PG_PCONS_V1_541640",
-      "PG_ZAPDOS_555379",
-      "HUMBLE_HYLIAN_713107",
-      "PG_BANANA_STAND_607245",
-      "PG_INTEG_BANANAPHONE_803595",
-      "PG_CARBONITE_PRIME_BENEFITS_BANNER_722856",
-      "PG_CARBONITE_747927",
-      "PG_KEYBEARERS_HALLOWEEN_PAGE_778298",
-      "PG_OBSIDIAN_794242",
-      "PG_THANK_YOU_RECS_TWO_796685",
-      "PG_EU_COOKIE_BANNER_COMPLIANCE_803731",
-      "PG_CARBONITE_REMAINING_FTUE_GLOBAL_LAUNCH_825106",
-      "PG_KEEP_IT_CASUAL_818343",
-      "IMPROVED_DISCOVERY_736602",
-      "PG_OCI_765028"
-    ]},
-    "query": """
-        fragment EntryPointsUser_TwitchAccount on TwitchAccount {
-            tuid
-            __typename
+# Change-detection probe: just enough to tell whether anything moved since the last full run
+probe_body = BodyTemplate(
+    "OffersContext_Offers_And_Items",
+    """
+      query OffersContext_Offers_And_Items(
+        $collectionType: CollectionType, $dateOverride: Time, $pageSize: Int, $after: String
+      ) {
+        items(collectionType: $collectionType, dateOverride: $dateOverride, pageSize: $pageSize, after: $after) {
+          items {
+            ...Item
+          }
+          pageInfo {
+            hasNextPage
+            endCursor
+          }
         }
+      }
 
-        fragment EntryPointsUser_CurrentUser on CurrentUser {
-            id
-            isTwitchPrime
-            isAmazonPrime
-            isSignedIn
-            firstName
-            twitchAccounts {
-                ...EntryPointsUser_TwitchAccount
-                __typename
+      fragment Item on Item {
+        offers {
+          id
+          startTime
+          endTime
+          offerSelfConnection {
+            eligibility {
+              offerState
+              isClaimed
             }
-            __typename
+          }
         }
+      }
+    """,
+    {"collectionType": ..., "pageSize": 999, "after": ...},
+    "OffersContext_Offers_And_Items:probe",
+)
 
-        fragment EntryPointsUser_Weblab on Weblab {
-            name
-            treatment
-            __typename
-        }
+# Listed collections and how they're called in the log
+COLLECTIONS = (("LOOT", "Loot"), ("FREE_GAMES", "Game"))
 
-        fragment EntryPointsUser_PrimeMarketplace on PrimeMarketplace {
-            id
-            marketplaceCode
-            __typename
-        }
 
-        fragment EntryPointsUser_CountryOfResidence on Country {
-            countryCode
-            primeGamingEligibility
-            __typename
+user_body = BodyTemplate(
+    "Entry_Points_User",
+    """
+      query Entry_Points_User {
+        currentUser {
+          isTwitchPrime
+          isAmazonPrime
+          isSignedIn
+          firstName
         }
+      }
+    """,
+    {},
+)
 
-        fragment EntryPointsUser_GeographicalCountry on Country {
-            countryCode
-            primeGamingEligibility
-            __typename
+# Publisher lookup: everything claim_offer and save_code need; the static part ends up in the offer cache
+offer_query = """
+  query ItemV2Context($itemId: String!, $dateOverride: Time, $stringDebug: Boolean, $previewId: String) {
+    itemV2(itemId: $itemId, dateOverride: $dateOverride, stringDebug: $stringDebug, previewId: $previewId) {
+      item {
+        id
+        grantsCode
+        assets {
+          id
+          title
+          externalClaimLink
+          claimInstructions
         }
-
-        query Entry_Points_User($weblabTreatmentList: [String!]!) {
-            currentUser {
-                ...EntryPointsUser_CurrentUser
-                __typename
-            }
-            primeMarketplace {
-                ...EntryPointsUser_PrimeMarketplace
-                __typename
-            }
-            countryOfResidence {
-                ...EntryPointsUser_CountryOfResidence
-                __typename
+        game {
+          id
+          assets {
+            title
+            publisher
+          }
+        }
+        offers {
+          id
+          startTime
+          endTime
+          offerSelfConnection {
+            eligibility {
+              isClaimed
+              canClaim
+              missingRequiredAccountLink
+              offerState
             }
-            geographicalCountry {
-                ...EntryPointsUser_GeographicalCountry
-                __typename
+          }
+        }
+      }
+      error {
+        code
+      }
+    }
+  }
+"""
+
+offer_body = BodyTemplate("ItemV2Context", offer_query, {"itemId": ..., "stringDebug": False}, "ItemV2Context:details")
+
+# Eligibility check for offers whose static details are already cached
+eligibility_body = BodyTemplate(
+    "ItemV2Context",
+    """
+      query ItemV2Context($itemId: String!, $dateOverride: Time, $stringDebug: Boolean, $previewId: String) {
+        itemV2(itemId: $itemId, dateOverride: $dateOverride, stringDebug: $stringDebug, previewId: $previewId) {
+          item {
+            id
+            offers {
+              id
+              offerSelfConnection {
+                eligibility {
+                  isClaimed
+                  canClaim
+                  missingRequiredAccountLink
+                  offerState
+                }
+              }
             }
-            weblabTreatmentList(weblabNameList: $weblabTreatmentList) {
-                ...EntryPointsUser_Weblab
-                __typename
+          }
+          error {
+            code
+          }
+        }
+      }
+    """,
+    {"itemId": ..., "stringDebug": False},
+    "ItemV2Context:eligibility",
+)
+
+# Code retrieval after a claim
+code_body = BodyTemplate(
+    "ItemV2Context",
+    """
+      query ItemV2Context($itemId: String!, $dateOverride: Time, $stringDebug: Boolean, $previewId: String) {
+        itemV2(itemId: $itemId, dateOverride: $dateOverride, stringDebug: $stringDebug, previewId: $previewId) {
+          item {
+            id
+            offers {
+              id
+              offerSelfConnection {
+                orderInformation {
+                  claimCode
+                  orderState
+                }
+              }
             }
+          }
+          error {
+            code
+          }
         }
+      }
     """,
+    {"itemId": ..., "stringDebug": False},
+    "ItemV2Context:code",
+)
+
+claim_body = BodyTemplate(
+    "placeOrdersDetailPage",
+    """
+      mutation placeOrdersDetailPage($input: PlaceOrdersInput!) {
+        placeOrders(input: $input) {
+          error {
+            code
+          }
+        }
+      }
+    """,
+    {"input": ...},
+)
+
+# Set by primelooter() when the on-disk offer cache is enabled
+offer_cache = None
+
+# Set by primelooter() when the claim ledger is enabled
+ledger = None
+
+# Set by primelooter(), where retrieved codes are stored
+code_store = None
+
+# Requests in flight across every account in this process, adapted to the responses and replaced by primelooter()
+request_limit = AdaptiveLimit("global", 16, maximum=64)
+
+# The limits may grow up to this many times --max-requests
+LIMIT_HEADROOM = 4
+
+# Each account's own share of that, by client
+account_limits = weakref.WeakKeyDictionary()
+
+# GraphQL error codes that mean we're going too fast rather than that something is wrong with the offer
+THROTTLE_CODES = re.compile(r"throttl|rate.?limit|too.?many", re.IGNORECASE)
+
+# Codes were appended here before the code store existed, it's imported once
+LEGACY_CODE_FILE = "game_codes.txt"
+
+# An unchanged probe only skips the run if the last full run is younger than this
+PROBE_MAX_AGE = 60 * 60 * 24
+
+# Offers left unclaimed get one more try this many seconds before they end, set by primelooter() from --pre-expiry;
+# the probe never skips that try
+pre_expiry_window = 60 * 60
+
+# A run interrupted longer ago than this starts over instead of resuming; pending codes are resumed regardless
+CHECKPOINT_MAX_AGE = 60 * 60 * 6
+
+# Offers ending sooner than this are claimed first, whatever else they are
+URGENT_WINDOW = 60 * 60 * 24
+
+# Set by primelooter() from the time budget: workers start no new claims after this time.monotonic() value
+run_deadline = None
+
+# Account-independent offer metadata shared by all accounts: game id -> publisher, persisted in the ledger
+game_publishers = {}
+
+# Lookups and claims pending at the same time are sent as one aliased request, overridden by primelooter(); only the
+# workers of one account add to a batch, so the size follows their number unless it is set
+batching = {
+    "size": 4,
+    "interval": 0.02,
 }
 
+# How codes of fresh claims are polled for: first wait, longest wait between polls and when to give up, in seconds
+code_polling = {
+    "first_delay": 2.0,
+    "max_delay": 15.0,
+    "timeout": 90.0,
+}
+
+# HTTP client settings, overridden by primelooter()
+transport = {
+    "http2": True,
+    "max_connections": 20,
+    "max_keepalive": 10,
+    "keepalive_expiry": 30.0,
+    "retries": 3,
+    "backoff": 1.0,
+    "max_backoff": 60.0,
+    "adaptive": True,
+}
+
+
 class AuthException(Exception):
     pass
 
+
+class OfferFailed(Exception):
+    """One step (details or claim) of one offer failed; the other offers carry on."""
+
+    def __init__(self, step: str, error: Exception):
+        super().__init__(f"{step} failed: {error}")
+        self.step = step
+
+
+class RunSummary:
+    """What the scheduler needs from a run: when new offers go live and when the unclaimed ones run out."""
+
+    def __init__(self):
+        self.next_start = None
+        self.unclaimed_ends = []
+        self.failed = 0
+        self.deferred = 0
+
+    def note_start(self, item: Item):
+        start = parse_time(item.offer.start_time) if item.offer else None
+        if start is not None and start > time.time() and (self.next_start is None or start < self.next_start):
+            self.next_start = start
+
+    def note_unclaimed(self, item: Item):
+        end = parse_time(item.offer.end_time) if item.offer else None
+        if end is not None:
+            self.unclaimed_ends.append(end)
+
+    def merge(self, other: "RunSummary"):
+        if other.next_start is not None and (self.next_start is None or other.next_start < self.next_start):
+            self.next_start = other.next_start
+        self.unclaimed_ends.extend(other.unclaimed_ends)
+        self.failed += other.failed
+        self.deferred += other.deferred
+
+
+class ClaimPlan:
+    """Hands out claimable offers most urgent first instead of in listing order.
+
+    Offers ending within URGENT_WINDOW come first, soonest expiry first. Then code-granting offers, which need
+    polling time after the claim, then the rest by expiry and the collection's own priority. Once run_deadline
+    has passed no new offer is handed out; the rest are kept in ``deferred`` for the next run.
+    """
+
+    LAST = (math.inf,)
+
+    def __init__(self):
+        self.queue = asyncio.PriorityQueue()
+        self.order = itertools.count()
+        self.deferred = []
+
+    @staticmethod
+    def urgency(item: Item, now: float) -> tuple:
+        end = parse_time(item.offer.end_time) if item.offer else None
+        end = math.inf if end is None else end
+        priority = math.inf if item.priority is None else item.priority
+        # Among the urgent ones only the expiry counts
+        later = end - now > URGENT_WINDOW
+        return (later, later and not item.grants_code, end, priority)
+
+    def add(self, item: Item):
+        # The counter keeps equally urgent offers in listing order and Items out of the comparison
+        self.queue.put_nowait((self.urgency(item, time.time()), next(self.order), item))
+
+    def close(self, workers: int):
+        for _ in range(workers):
+            self.queue.put_nowait((self.LAST, next(self.order), None))
+
+    async def next(self):
+        while (item := (await self.queue.get())[2]) is not None:
+            if run_deadline is None or time.monotonic() < run_deadline:
+                return item
+            self.deferred.append(item)
+        return None
+
+
+def record_offer(item: Item, state: str, publisher: str = None):
+    metrics.inc("offers", outcome=state)
+    if ledger is None:
+        return
+
+    ledger.record(current_account.get(), item.offer.id, state, item.name, publisher)
+
+
+def checkpoint(item: Item, step: str):
+    if ledger is not None:
+        ledger.set_checkpoint(current_account.get(), item.offer.id, step)
+
+
+def create_client() -> httpx.AsyncClient:
+    use_http2 = transport["http2"]
+    if use_http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log.warning("HTTP/2 needs the h2 package (pip install httpx[http2]), falling back to HTTP/1.1")
+            use_http2 = False
+
+    limits = httpx.Limits(
+        max_connections=transport["max_connections"],
+        max_keepalive_connections=transport["max_keepalive"],
+        keepalive_expiry=transport["keepalive_expiry"],
+    )
+    return httpx.AsyncClient(http2=use_http2, limits=limits, timeout=httpx.Timeout(30, connect=10))
+
+
+def retry_delay(response: httpx.Response, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), transport["max_backoff"])
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(retry_after).timestamp()
+                return min(max(0.0, when - time.time()), transport["max_backoff"])
+            except (TypeError, ValueError):
+                pass
+
+    delay = transport["backoff"] * 2**attempt
+    return min(delay + random.uniform(0, delay / 2), transport["max_backoff"])
+
+
+def account_limit(client: httpx.AsyncClient) -> AdaptiveLimit:
+    limit = account_limits.get(client)
+    if limit is None:
+        limit = account_limits[client] = AdaptiveLimit(
+            current_account.get() or "account",
+            request_limit.initial,
+            maximum=request_limit.maximum,
+            adaptive=request_limit.adaptive,
+        )
+    return limit
+
+
+def throttled(client: httpx.AsyncClient, reason: str):
+    account_limit(client).throttled(reason)
+    request_limit.throttled(reason)
+
+
+def request_limits() -> dict:
+    return {"global": request_limit.status()} | {limit.name: limit.status() for limit in account_limits.values()}
+
+
+async def send(
+    client: httpx.AsyncClient, method: str, url: str, operation: str = None, stream: bool = False, **kwargs
+) -> httpx.Response:
+    # Transient failures (connection trouble, 429, 5xx) are retried here instead of failing the whole run
+    limit = account_limit(client)
+    for attempt in range(transport["retries"] + 1):
+        response = None
+        try:
+            # The account's slot first, so an account that's backing off doesn't hold global slots while it waits
+            async with limit, request_limit:
+                started = time.perf_counter()
+                response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+            if response.status_code != 429 and response.status_code < 500:
+                latency = time.perf_counter() - started
+                limit.succeeded(latency, operation)
+                request_limit.succeeded(latency, operation)
+                return response
+            problem = f"HTTP {response.status_code}"
+            if stream and attempt < transport["retries"]:
+                await response.aclose()
+        except httpx.TransportError as e:
+            throttled(client, type(e).__name__)
+            if attempt == transport["retries"]:
+                raise
+            problem = repr(e)
+        else:
+            throttled(client, problem)
+
+        if attempt == transport["retries"]:
+            return response
+
+        delay = retry_delay(response, attempt)
+        retries = transport["retries"]
+        log.warning("%s %s: %s, retrying in %.1fs (%d/%d)", method, url, problem, delay, attempt + 1, retries)
+        metrics.inc("retries", method=method)
+        await asyncio.sleep(delay)
+
+
+async def post_gql(
+    client: httpx.AsyncClient, headers: dict, template: BodyTemplate, stream: bool = False, **variables
+) -> httpx.Response:
+    # A streamed response is read and closed by the caller, which also counts its bytes
+    started = time.perf_counter()
+    response = await send(
+        client,
+        "POST",
+        gql_url,
+        operation=template.label,
+        stream=stream,
+        headers=headers,
+        content=template.render(**variables),
+    )
+
+    metrics.observe("request_seconds", time.perf_counter() - started, operation=template.label)
+    metrics.inc("requests", operation=template.label, status=response.status_code)
+    if not stream:
+        metrics.inc("response_bytes", len(response.content), operation=template.label)
+    return response
+
+
+class Batcher:
+    """Collects calls of one operation on one client and sends them as aliased multi-field requests.
+
+    A batch goes out once it is full or ``batching["interval"]`` after its first call; every caller gets its own
+    field of the response back, or the exception if the whole request failed. A batch the API turns down as a whole
+    is sent again one call at a time, and if that works, the client stops aliasing the operation.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, headers: dict, template: BodyTemplate):
+        self.client = client
+        self.headers = headers
+        self.template = template
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.aliasing = True
+
+    async def call(self, value):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((value, future))
+        if len(self.pending) >= batching["size"]:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(batching["interval"], self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        size = max(1, batching["size"])
+        while self.pending:
+            batch, self.pending = self.pending[:size], self.pending[size:]
+            task = asyncio.create_task(self.send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, batch: list):
+        if len(batch) > 1 and self.aliasing:
+            name = self.template.names[0]
+            template = self.template.batch(len(batch))
+            variables = {f"{name}{i}": value for i, (value, _) in enumerate(batch)}
+            fields = [(f"b{i}", future) for i, (_, future) in enumerate(batch)]
+            if await self.request(template, variables, fields, whole=True) is not None:
+                return
+            log.debug("%s: Batch of %d turned down, sending it one by one", template.label, len(batch))
+
+        results = await asyncio.gather(*(self.send_one(value, future) for value, future in batch))
+        if len(batch) > 1 and self.aliasing and any(results):
+            self.aliasing = False
+            log.warning("%s: Aliased batches aren't accepted, sending one call per request", self.template.label)
+
+    async def send_one(self, value, future: asyncio.Future) -> int:
+        variables = {self.template.names[0]: value}
+        return await self.request(self.template, variables, [(self.template.field, future)])
+
+    async def request(self, template: BodyTemplate, variables: dict, fields: list, whole: bool = False):
+        """Send one request and hand every caller its field or the error; returns how many got a result.
+
+        With ``whole``, a request turned down as a whole (HTTP 400, or errors without any data) returns None instead
+        and leaves the callers waiting.
+        """
+        try:
+            response = await post_gql(self.client, self.headers, template, **variables)
+            if whole and response.status_code == 400:
+                return None
+            response.raise_for_status()
+            body = response.json()
+        except Exception as e:
+            for _, future in fields:
+                if not future.done():
+                    future.set_exception(e)
+            return 0
+
+        if whole and body.get("data") is None and body.get("errors"):
+            return None
+
+        data = body.get("data") or {}
+        results = 0
+        for alias, future in fields:
+            if future.done():
+                continue
+            if data.get(alias) is None:
+                future.set_exception(LookupError(f"{template.label}: No result for {alias} ({body.get('errors')})"))
+            else:
+                future.set_result(data[alias])
+                results += 1
+        return results
+
+
+# Batchers by client and operation; they go away with the client
+batchers = weakref.WeakKeyDictionary()
+
+
+async def call_batched(client: httpx.AsyncClient, headers: dict, template: BodyTemplate, value):
+    client_batchers = batchers.setdefault(client, {})
+    batcher = client_batchers.get(template.label)
+    if batcher is None:
+        batcher = client_batchers[template.label] = Batcher(client, headers, template)
+    return await batcher.call(value)
+
+
+def log_transfer_summary():
+    request_counts = metrics.run.counters_by("requests", "operation")
+    if not request_counts:
+        return
+
+    response_bytes = metrics.run.counters_by("response_bytes", "operation")
+    retries = sum(metrics.run.counters_by("retries", "method").values())
+    total = sum(response_bytes.values())
+    log.info("Received %.1f KB in %d requests", total / 1024, sum(request_counts.values()), extra=MAGENTA_LOG)
+    if retries:
+        log.info("Retried %d requests", retries, extra=MAGENTA_LOG)
+    backoffs = sum(metrics.run.counters_by("backoffs", "limit").values())
+    if backoffs:
+        log.info("Backed off %d times, now %d requests in flight", backoffs, request_limit.limit, extra=MAGENTA_LOG)
+    for label, count in sorted(request_counts.items()):
+        log.info("  %s: %d requests, %.1f KB", label, count, response_bytes.get(label, 0) / 1024, extra=MAGENTA_LOG)
+
+
+@metrics.timed("authenticate")
 async def authenticate(client: httpx.AsyncClient, headers: dict) -> True:
     try:
-        user_response = await client.post(gql_url, headers=headers, data=json.dumps(user_payload))
+        user_response = await post_gql(client, headers, user_body)
         user_response.raise_for_status()
 
         user_data = user_response.json()["data"]["currentUser"]
@@ -232,201 +777,833 @@ async def authenticate(client: httpx.AsyncClient, headers: dict) -> True:
         elif not user_data["isTwitchPrime"]:
             raise AuthException("Authentication: Not a valid Twitch Prime account.")
 
-        log.info(f"Authentication: Success! User: {user_data['firstName']}")
+        log.info("Authentication: Success! User: %s", user_data["firstName"])
 
     except Exception as e:
-        log.error(f"Authentication error: {e}")
+        log.error("Authentication error: %s", e)
         raise
 
-async def offers_list(client: httpx.AsyncClient, headers: dict):
-    try:
-        list_response = await client.post(gql_url, headers=headers, data=json.dumps(list_payload))
-        list_response.raise_for_status()
 
-        loot_items = list_response.json()["data"]["inGameLoot"]["items"]
-        games_items = list_response.json()["data"]["games"]["items"]
+# What list_items keeps of a page; the rest of the response is only scanned
+PAGE_ITEM = ("data", "items", "items", ANY)
+PAGE_INFO = ("data", "items", "pageInfo")
+PAGE_ERRORS = ("errors",)
+
+
+# False once the API turned a cursor query down, every listing after that asks for one big page like it used to
+cursor_paging = True
+single_pages = {}
 
-        async def process_items(items_list, item_type):
-            claimed_count = 0
-            unclaimed_count = 0
-            can_claim = []
 
-            for item in items_list:
-                if item["assets"]["title"] not in blacklist and item['game']['assets']['title'] not in blacklist:
-                    eligibility = item["offers"][0]["offerSelfConnection"]["eligibility"]
-                    is_claimed = eligibility.get("isClaimed", False)
+def single_page(template: BodyTemplate, collection: str) -> BodyTemplate:
+    """The listing from before cursor paging: ``template``'s fragment, one collection, a single page of up to 999."""
+    key = (template.label, collection)
+    body = single_pages.get(key)
+    if body is None:
+        fragments = template.query.partition("fragment")
+        query = f"""
+          query {template.operation_name}($dateOverride: Time, $pageSize: Int) {{
+            items(collectionType: {collection}, dateOverride: $dateOverride, pageSize: $pageSize) {{
+              items {{
+                ...Item
+              }}
+            }}
+          }}
 
-                    if is_claimed:
-                        log.info(f"{BLUE}{item['game']['assets']['title']} - {item['assets']['title']} - {item_type}: Already collected.{RESET}")
-                        claimed_count += 1
-                    else:
-                        log.info(f"{CYAN}{item['game']['assets']['title']} - {item['assets']['title']} - {item_type}: Trying to claim.{RESET}")
-                        unclaimed_count += 1
-                        can_claim.append(item)
+          {"".join(fragments[1:])}
+        """
+        body = BodyTemplate(template.operation_name, query, {"pageSize": 999}, f"{template.label}:single")
+        single_pages[key] = body
+    return body
 
-            log.info(f"{MAGENTA}Number of {item_type}: {len(items_list)}{RESET}")
-            log.info(f"{MAGENTA}Claimed: {claimed_count}{RESET}")
-            log.info(f"{MAGENTA}Unclaimed: {unclaimed_count}{RESET}\n")
 
-            return can_claim
+def paging_rejected(errors) -> bool:
+    # Only a schema without the cursor fields sends listings back to one page, throttling or auth errors don't
+    for error in errors if isinstance(errors, list) else ():
+        if not isinstance(error, dict):
+            continue
+        code = (error.get("extensions") or {}).get("code")
+        if code == "GRAPHQL_VALIDATION_FAILED" or 'Cannot query field "pageInfo"' in str(error.get("message")):
+            return True
+    return False
 
-        loot_can_claim = await process_items(loot_items, "Loot")
-        games_can_claim = await process_items(games_items, "Game")
 
-        return loot_can_claim + games_can_claim
+async def list_items(client: httpx.AsyncClient, headers: dict, template: BodyTemplate, collection: str):
+    """Yield the items of one collection one by one as the response streams in, following the cursor to the end.
+
+    Only one item's JSON is held at a time, so memory doesn't grow with the size of the catalog. When the schema
+    turns the paged query down as invalid, the collection is listed in one page instead.
+    """
+    global cursor_paging
+    paging, after = cursor_paging, None
+    while True:
+        if paging:
+            response = await post_gql(client, headers, template, stream=True, collectionType=collection, after=after)
+        else:
+            response = await post_gql(client, headers, single_page(template, collection), stream=True)
+        page_info, errors, received, listed = None, None, 0, 0
+        try:
+            if response.status_code == 400 and paging and after is None:
+                # GraphQL servers answer a query their schema doesn't allow with HTTP 400 and the errors in the body
+                received = len(await response.aread())
+                try:
+                    errors = json.loads(response.content).get("errors")
+                except (ValueError, AttributeError):
+                    pass
+            else:
+                response.raise_for_status()
+                parser = JsonStream((PAGE_ITEM, PAGE_INFO, PAGE_ERRORS))
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    for path, value in parser.feed(chunk):
+                        if path == PAGE_ITEM:
+                            listed += 1
+                            yield Item.parse(value)
+                        elif path == PAGE_INFO:
+                            page_info = value
+                        else:
+                            errors = value
+                parser.close()
+        finally:
+            await response.aclose()
+            metrics.inc("response_bytes", received, operation=template.label)
+
+        if paging and after is None and page_info is None and not listed and paging_rejected(errors):
+            log.warning("%s: No cursor paging (%s), listing %s in one page", template.label, errors, collection)
+            cursor_paging = paging = False
+            continue
+        response.raise_for_status()
+        if not paging or (page_info is None and listed):
+            # The single page, or a server that ignored the cursor and sent everything at once
+            if errors and not listed:
+                raise LookupError(f"{template.label}: No items in the response ({errors})")
+            return
+        if page_info is None:
+            raise LookupError(f"{template.label}: No items in the response ({errors})")
+        if not page_info.get("hasNextPage") or not page_info.get("endCursor"):
+            return
+        after = page_info["endCursor"]
+
+
+@metrics.timed("offers_list")
+async def offers_list(
+    client: httpx.AsyncClient,
+    headers: dict,
+    publishers: FilterRules,
+    collection: str,
+    item_type: str,
+    plan: ClaimPlan,
+    settled: set = frozenset(),
+    summary: RunSummary = None,
+    resumed: dict = None,
+):
+    # Claimable items go into the plan as soon as they are parsed off the response, workers pick the most urgent one
+    listed_count = 0
+    claimed_count = 0
+    unclaimed_count = 0
+    settled_count = 0
+    skipped_count = 0
+    resumed_count = 0
+    resumed = resumed or {}
+
+    try:
+        async for item in list_items(client, headers, list_body, collection):
+            listed_count += 1
+            if summary is not None:
+                summary.note_start(item)
+
+            if item.offer is None or publishers.title_excluded(item.title, item.game_title):
+                continue
+            # A claimed offer still waiting for its code is settled in the ledger, but not done yet
+            code_pending = resumed.get(item.offer.id) == CODE_PENDING
+            if item.offer.id in settled and not code_pending:
+                settled_count += 1
+                continue
+            if resumed.get(item.offer.id) == DONE:
+                resumed_count += 1
+                continue
+
+            is_claimed = item.offer.eligibility is not None and item.offer.eligibility.is_claimed
+            # Publishers seen in earlier detail responses are filtered here, without any request
+            publisher = game_publishers.get(item.game_id)
+
+            if is_claimed:
+                log.info("%s - %s: Already collected.", item.name, item_type, extra=BLUE_LOG)
+                claimed_count += 1
+                record_offer(item, CLAIMED)
+                if code_pending:
+                    plan.add(item)
+            elif publisher is not None and not publishers.publisher_allowed(publisher):
+                log.debug("%s - %s: Skipped, publisher %s not wanted.", item.name, item_type, publisher)
+                skipped_count += 1
+                record_offer(item, SKIPPED_PUBLISHER, publisher)
+            else:
+                log.info("%s - %s: Trying to claim.", item.name, item_type, extra=CYAN_LOG)
+                unclaimed_count += 1
+                plan.add(item)
 
     except Exception as e:
-        log.error(f"Offer list error: {e}")
+        log.error("Offer list error: %s", e)
         raise
 
-async def get_offer(item: dict, client: httpx.AsyncClient, headers: dict):
-    offer_payload = {
-        "operationName": "ItemV2Context",
-        "variables": {
-            "itemId": item["assets"]["id"],
-            "stringDebug": False,
-            "redirectUrl": item["assets"]["externalClaimLink"]
-        },
-        "extensions": {},
-        "query": "query ItemV2Context($itemId: String!, $dateOverride: Time, $stringDebug: Boolean, $previewId: String, $redirectUrl: String) {\n  itemV2(itemId: $itemId, dateOverride: $dateOverride, stringDebug: $stringDebug, previewId: $previewId) {\n    item {\n      ...ItemPageItem\n      __typename\n    }\n    error {\n      code\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment ItemMediaAsset on MediaAsset {\n  src1x\n  src2x\n  type\n  __typename\n}\n\nfragment Item_Media on Media {\n  alt\n  description\n  defaultMedia {\n    ...ItemMediaAsset\n    __typename\n  }\n  desktop {\n    ...ItemMediaAsset\n    __typename\n  }\n  tablet {\n    ...ItemMediaAsset\n    __typename\n  }\n  videoPlaceholderImage {\n    ...ItemMediaAsset\n    __typename\n  }\n  __typename\n}\n\nfragment ItemHeroAsset on MediaAsset {\n  src1x\n  src2x\n  type\n  __typename\n}\n\nfragment ItemContextHeroAssets on Media {\n  defaultMedia {\n    ...ItemHeroAsset\n    __typename\n  }\n  tablet {\n    ...ItemHeroAsset\n    __typename\n  }\n  desktop {\n    ...ItemHeroAsset\n    __typename\n  }\n  videoPlaceholderImage {\n    ...ItemHeroAsset\n    __typename\n  }\n  alt\n  __typename\n}\n\nfragment Item_Assets on ItemAssets {\n  additionalMedia {\n    ...Item_Media\n    __typename\n  }\n  claimInstructions\n  mobileClaimInstructions\n  claimVisualInstructions {\n    ...Item_Media\n    __typename\n  }\n  thumbnailImage {\n    ...Item_Media\n    __typename\n  }\n  externalClaimLink\n  faqList {\n    question\n    answer\n    __typename\n  }\n  heroMedia {\n    ...ItemContextHeroAssets\n    __typename\n  }\n  cardMedia {\n    ...Item_Media\n    __typename\n  }\n  id\n  itemDetails\n  longformDescription\n  platforms\n  platformsDisplay\n  shortformDescription\n  title\n  urlSlug\n  redemptionPlatforms\n  __typename\n}\n\nfragment Game on GameV2 {\n  id\n  accountLinkConfig(redirectUrl: $redirectUrl) {\n    accountType\n    linkingUrl\n    thirdPartyAccountManagementUrl\n    __typename\n  }\n  assets {\n    title\n    publisher\n    accountName\n    primaryDeveloper\n    otherDevelopers\n    longformDescription\n    genres\n    localizedGenres\n    gameModes\n    localizedGameModes\n    releaseDate\n    platformsDisplay\n    purchaseGameText\n    faqList {\n      question\n      answer\n      __typename\n    }\n    vendorIcon {\n      ...GameVendorIcon\n      __typename\n    }\n    ageRating {\n      ...Age_Rating\n      __typename\n    }\n    coverArt {\n      ...Item_Media\n      __typename\n    }\n    additionalMedia {\n      ...Item_Media\n      __typename\n    }\n    __typename\n  }\n  gameSelfConnection {\n    isSubscribedToNotifications\n    accountLink {\n      id\n      accountType\n      displayName\n      status\n      __typename\n    }\n    __typename\n  }\n  officialWebsite\n  thirdPartySupportPageUrl\n  isActiveAndVisible\n  __typename\n}\n\nfragment GameVendorIcon on Media {\n  alt\n  defaultMedia {\n    src1x\n    src2x\n    type\n    __typename\n  }\n  __typename\n}\n\nfragment Item_Offer on Offer {\n  id\n  startTime\n  endTime\n  legalInformation {\n    longLegal\n    shortLegal\n    __typename\n  }\n  offerSelfConnection {\n    eligibility {\n      ...Item_Offer_Eligibility\n      __typename\n    }\n    orderInformation {\n      ...Item_Offer_Order_Info\n      __typename\n    }\n    __typename\n  }\n  __typename\n}\n\nfragment Age_Rating on AgeRating {\n  rating\n  ratingDisplay\n  tags\n  ratingMediaAssetUrl\n  ratingLearnMoreUrl\n  ratingSystem\n  __typename\n}\n\nfragment Item_Alert on Alert {\n  id\n  type\n  button {\n    text\n    url\n    __typename\n  }\n  message\n  order\n  __typename\n}\n\nfragment Item_Pixel on Pixel {\n  type\n  pixel\n  __typename\n}\n\nfragment ItemPageItem on Item {\n  id\n  isDirectEntitlement\n  requiresLinkBeforeClaim\n  grantsCode\n  isDeepLink\n  isFGWP\n  redirectPath\n  portalEntityUrl\n  assets {\n    ...Item_Assets\n    __typename\n  }\n  game {\n    ...Game\n    __typename\n  }\n  offers {\n    ...Item_Offer\n    __typename\n  }\n  alertList {\n    ...Item_Alert\n    __typename\n  }\n  pixels {\n    ...Item_Pixel\n    __typename\n  }\n  __typename\n}\n\nfragment Item_Offer_Order_Info on OfferOrderInformation {\n  id\n  entitledAccountId\n  entitledAccountName\n  orderDate\n  claimCode\n  deepLinkUrl\n  orderState\n  __typename\n}\n\nfragment Item_Offer_Eligibility on OfferEligibility {\n  isClaimed\n  canClaim\n  claimTime\n  conflictingClaimAccount {\n    fullName\n    obfuscatedEmail\n    __typename\n  }\n  isPrimeGaming\n  missingRequiredAccountLink\n  gameAccountDisplayName\n  offerState\n  inRestrictedMarketplace\n  inRestrictedCountry\n  maxOrdersExceeded\n  __typename\n}\n",
-    }
+    log.info("Number of %s: %d", item_type, listed_count, extra=MAGENTA_LOG)
+    log.info("Claimed: %d", claimed_count, extra=MAGENTA_LOG)
+    if settled:
+        log.info("Settled in ledger: %d", settled_count, extra=MAGENTA_LOG)
+    if skipped_count:
+        log.info("Skipped by publisher: %d", skipped_count, extra=MAGENTA_LOG)
+    if resumed_count:
+        log.info("Done before the interruption: %d", resumed_count, extra=MAGENTA_LOG)
+    log.info("Unclaimed: %d\n", unclaimed_count, extra=MAGENTA_LOG)
+
+
+@metrics.timed("probe")
+async def probe_offers(client: httpx.AsyncClient, headers: dict, publishers: FilterRules) -> tuple:
+    summary = RunSummary()
+    states = []
+
+    async def probe_collection(collection: str):
+        async for item in list_items(client, headers, probe_body, collection):
+            if item.offer is None:
+                continue
+            summary.note_start(item)
+            eligibility = item.offer.eligibility or Eligibility()
+            states.append(f"{item.offer.id}:{eligibility.offer_state}:{eligibility.is_claimed}")
+
+    await asyncio.gather(*(probe_collection(collection) for collection, _ in COLLECTIONS))
+
+    # publishers.txt is part of the fingerprint, editing it has to trigger a full run
+    fingerprint = hashlib.sha1("\n".join(sorted(states) + sorted(publishers.lines)).encode()).hexdigest()
+    return fingerprint, summary
+
+
+def check_throttled(client: httpx.AsyncClient, error):
+    code = error.get("code") if isinstance(error, dict) else error
+    if isinstance(code, str) and THROTTLE_CODES.search(code):
+        throttled(client, code)
+
+
+async def fetch_item(client: httpx.AsyncClient, headers: dict, template: BodyTemplate, item: Item) -> dict:
+    item_v2 = await call_batched(client, headers, template, item.asset_id)
+
+    if item_v2["error"] is not None:
+        log.error("Error: %s", item_v2["error"])
+        check_throttled(client, item_v2["error"])
 
+    return item_v2["item"]
+
+
+@metrics.timed("get_offer")
+async def get_offer(item: Item, client: httpx.AsyncClient, headers: dict) -> Item:
     try:
-        offer_response = await client.post(gql_url, headers=headers, data=json.dumps(offer_payload))
-        offer_response.raise_for_status()
+        cached = offer_cache.get(item) if offer_cache is not None else None
+        if cached is not None:
+            state = await fetch_item(client, headers, eligibility_body, item)
+            if state is not None:
+                cached.update(state)
+                return cached
+
+            offer_cache.invalidate(item)
 
-        offer = offer_response.json()["data"]["itemV2"]["item"]
+        data = await fetch_item(client, headers, offer_body, item)
+        if data is None:
+            return None
 
-        if offer_response.json()["data"]["itemV2"]["error"] is not None:
-            log.error(f"Error: {offer_response.json()['data']['itemV2']['error']}")
+        offer = Item.parse(data)
+        if offer_cache is not None and offer.offer is not None:
+            offer_cache.put(offer)
 
         return offer
 
     except Exception as e:
-        log.error(f"Offer error: {e}")
+        log.error("Offer error: %s", e)
         raise
 
-async def claim_offer(item: dict, link: str, client: httpx.AsyncClient, headers: dict) -> True:
-    eligibility = item["offers"][0]["offerSelfConnection"]["eligibility"]
 
-    if not eligibility["isClaimed"]:
-        if not eligibility["canClaim"] and eligibility["missingRequiredAccountLink"]:
-            log.error(f"{RED}{item['game']['assets']['title']} - {item['assets']['title']}: Account link required. Link:{GREEN} {link}{RESET}")
-            return
+async def resumed_offer(item: Item, client: httpx.AsyncClient, headers: dict) -> Item:
+    # The list query leaves out fields the code is saved with, like the claim instructions
+    offer = offer_cache.get(item) if offer_cache is not None else None
+    if offer is None:
+        try:
+            offer = await get_offer(item, client, headers)
+        except Exception as e:
+            log.warning("%s: No details for the resumed code (%s)", item.name, e)
+    if offer is None:
+        return item
 
-        log.info(f"Collecting {item['game']['assets']['title']} - {item['assets']['title']}")
-        claim_payload = {
-            "operationName": "placeOrdersDetailPage",
-            "variables": {
-                "input": {
-                    "offerIds": item["offers"][0]["id"],
-                    "attributionChannel": f'{{"eventId":"ItemDetailRootPage:{item["offers"][0]["id"]}","page":"ItemDetailPage"}}',
-                }
-            },
-            "extensions": {},
-            "query": """
-                fragment Place_Orders_Payload_Order_Information on OfferOrderInformation {
-                  catalogOfferId
-                  claimCode
-                  entitledAccountId
-                  entitledAccountName
-                  id
-                  orderDate
-                  orderState
-                  __typename
-                }
+    offer.offer = item.offer
+    return offer
 
-                mutation placeOrdersDetailPage($input: PlaceOrdersInput!) {
-                  placeOrders(input: $input) {
-                    error {
-                      code
-                      __typename
-                    }
-                    orderInformation {
-                      ...Place_Orders_Payload_Order_Information
-                      __typename
-                    }
-                    __typename
-                  }
-                }
-            """,
+
+class CodeRetrieval:
+    """Polls for the codes of freshly claimed offers in the background so claiming never waits on them.
+
+    Every pending offer backs off on its own; all offers due at the same moment are polled together.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, headers: dict, first_delay=2.0, max_delay=15.0, timeout=90.0):
+        self.client = client
+        self.headers = headers
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.pending = {}
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.task = None
+        self.timed_out = []
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def add(self, item: Item):
+        now = time.monotonic()
+        self.pending[item.offer.id] = [item, now + self.first_delay, self.first_delay, now + self.timeout, now]
+        self.wakeup.set()
+
+    async def close(self):
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+
+    async def poll(self, entry: list) -> bool:
+        item = entry[0]
+        try:
+            order = await fetch_item(self.client, self.headers, code_body, item)
+        except Exception as e:
+            log.warning("%s: Code lookup failed, retrying (%s)", item.name, e)
+            return False
+
+        if order is not None:
+            item.update(order)
+        return bool(item.offer.claim_code)
+
+    async def run(self):
+        while self.pending or not self.closing:
+            self.wakeup.clear()
+            if not self.pending:
+                await self.wakeup.wait()
+                continue
+
+            next_poll = min(entry[1] for entry in self.pending.values())
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(0, next_poll - time.monotonic()))
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.monotonic()
+            due = [(offer_id, entry) for offer_id, entry in self.pending.items() if entry[1] <= now]
+            resolved = await asyncio.gather(*(self.poll(entry) for _, entry in due))
+
+            now = time.monotonic()
+            saved = []
+            for (offer_id, entry), has_code in zip(due, resolved):
+                item, _, delay, deadline, added = entry
+                if has_code:
+                    metrics.observe("phase_seconds", now - added, phase="code_retrieval")
+                    save_code(item)
+                    saved.append(item)
+                    del self.pending[offer_id]
+                elif now >= deadline:
+                    log.error("Unable to retrieve the code after %.0fs for %s", self.timeout, item.name, extra=RED_LOG)
+                    metrics.inc("offers", outcome="code_timeout")
+                    self.timed_out.append(offer_id)
+                    del self.pending[offer_id]
+                else:
+                    delay = min(delay * 2, self.max_delay)
+                    entry[1] = min(now + delay, deadline)
+                    entry[2] = delay
+
+            # A code only counts as done once it's on disk
+            if saved and code_store is not None:
+                code_store.flush()
+            for item in saved:
+                checkpoint(item, DONE)
+
+
+@metrics.timed("claim")
+async def claim_offer(item: Item, link: str, client: httpx.AsyncClient, headers: dict, codes: CodeRetrieval) -> True:
+    eligibility = item.offer.eligibility
+
+    if eligibility.is_claimed:
+        record_offer(item, CLAIMED)
+        checkpoint(item, DONE)
+        return True
+    else:
+        if not eligibility.can_claim and eligibility.missing_account_link:
+            log.error("%s: Account link required. Link: %s", item.name, link, extra=RED_LOG)
+            record_offer(item, NEEDS_LINK)
+            checkpoint(item, DONE)
+            return False
+
+        log.info("Collecting %s", item.name)
+        claim_input = {
+            "offerIds": item.offer.id,
+            "attributionChannel": f'{{"eventId":"ItemDetailRootPage:{item.offer.id}","page":"ItemDetailPage"}}',
         }
 
-        claim_response = await client.post(gql_url, headers=headers, data=json.dumps(claim_payload))
-        if claim_response.json()["data"]["placeOrders"]["error"] is not None:
-            log.error(f"Error: {claim_response.json()['data']['placeOrders']['error']}")
+        claim_error = (await call_batched(client, headers, claim_body, claim_input))["error"]
+        if claim_error is not None:
+            # A failure like any other, the offer is retried and the run isn't fingerprinted as settled
+            check_throttled(client, claim_error)
+            raise LookupError(f"Claim error: {claim_error}")
+
+        record_offer(item, CLAIMED)
+
+        if item.grants_code:
+            checkpoint(item, CODE_PENDING)
+            codes.add(item)
+        else:
+            checkpoint(item, DONE)
+        return True
 
-        offer = await get_offer(item, client, headers)
-        if offer.get("grantsCode") is True:
-            await get_code(item, client, headers)
 
-async def get_code(item: dict, client: httpx.AsyncClient, headers: dict) -> True:
-    max_retries = 5
-    retry_count = 0
+def save_code(item: Item):
+    log.info("%s Saving Code: %s", item.name, item.offer.claim_code)
 
-    while retry_count < max_retries:
-        if client.is_closed:
-            client = httpx.AsyncClient()
+    if code_store is not None:
+        code_store.add(current_account.get(), item)
+    record_offer(item, CODE_RETRIEVED)
 
+
+async def process_offer(
+    item: Item, client: httpx.AsyncClient, headers: dict, publishers: FilterRules, codes: CodeRetrieval
+) -> bool:
+    # Another account may have learned the publisher since the list was filtered
+    publisher = game_publishers.get(item.game_id)
+    if publisher is not None and not publishers.publisher_allowed(publisher):
+        record_offer(item, SKIPPED_PUBLISHER, publisher)
+        return True
+
+    try:
         offer = await get_offer(item, client, headers)
-        order_information = offer["offers"][0]["offerSelfConnection"]["orderInformation"]
+    except Exception as e:
+        raise OfferFailed("details", e) from e
 
-        if order_information and order_information[0].get("claimCode"):
-            write_to_file(offer)
-            break
+    if offer is not None and offer.publisher is not None:
+        if publisher != offer.publisher:
+            game_publishers[item.game_id] = offer.publisher
+            if ledger is not None:
+                ledger.set_game_publisher(item.game_id, offer.publisher)
 
-        retry_count += 1
-        await asyncio.sleep(3)
+        if not publishers.publisher_allowed(offer.publisher):
+            record_offer(item, SKIPPED_PUBLISHER, offer.publisher)
+            return True
 
-    if retry_count == max_retries:
-        log.error(f"{RED} Unable to retrieve the code after {max_retries} retries for {item['game']['assets']['title']} - {item['assets']['title']}{RESET}")
+        try:
+            return await claim_offer(offer, item.claim_link, client, headers, codes)
+        except Exception as e:
+            raise OfferFailed("claim", e) from e
 
-def write_to_file(item, separator_string=None):
-    separator_string = separator_string or "========================\n========================"
-    with open("./game_codes.txt", "a", encoding="utf-8") as f:
-        claim_code = item["offers"][0]["offerSelfConnection"]["orderInformation"][0]["claimCode"]
-        instructions = item["assets"]["claimInstructions"].replace('\\n', ' ')
+    return False
 
-        log.info(f"{item['game']['assets']['title']} - {item['assets']['title']} Saving Code: {claim_code}")
 
-        f.write(
-            f"{item['game']['assets']['title']} - {item['assets']['title']} Code: {claim_code}\n\n"
-            f"{instructions}\n{separator_string}\n"
+async def process_offer_grouped(
+    item: Item, client: httpx.AsyncClient, headers: dict, publishers: FilterRules, codes: CodeRetrieval
+) -> bool:
+    buffer = []
+    token = item_log_buffer.set(buffer)
+    try:
+        return await process_offer(item, client, headers, publishers, codes)
+    except Exception as e:
+        log.error("%s: Failed: %s", item.name, e, extra=RED_LOG)
+        metrics.inc("offers", outcome="failed", step=getattr(e, "step", "other"))
+        raise
+    finally:
+        item_log_buffer.reset(token)
+        for record in buffer:
+            log.handle(record)
+
+
+async def filter_offers(
+    client: httpx.AsyncClient, headers: dict, publishers: FilterRules, concurrency: int = 4, incremental: bool = False
+) -> RunSummary:
+    settled = set()
+    if incremental and ledger is not None:
+        states = ledger.states(current_account.get())
+        settled = {offer_id for offer_id, entry in states.items() if is_settled(entry, publishers)}
+
+    # Offers an interrupted run already finished are left alone, claimed ones still waiting for their code go
+    # straight to code retrieval
+    resumed = ledger.checkpoint(current_account.get(), CHECKPOINT_MAX_AGE) if ledger is not None else {}
+    if resumed:
+        pending_codes = sum(step == CODE_PENDING for step in resumed.values())
+        log.info(
+            "Resuming the last run: %d offers done, %d codes to fetch.",
+            len(resumed) - pending_codes,
+            pending_codes,
+            extra=MAGENTA_LOG,
         )
 
-async def filter_offers(client: httpx.AsyncClient, headers: dict, publishers: dict) -> True:
-    offer_list = await offers_list(client, headers)
+    summary = RunSummary()
+    codes = CodeRetrieval(client, headers, **code_polling)
+    codes.start()
 
-    for item in offer_list:
-        offer = await get_offer(item, client, headers)
-        
-        if "game" in offer and "publisher" in offer["game"]["assets"]:
-            publisher = offer["game"]["assets"]["publisher"]
+    # A fixed pool of workers claims while the collections are still being listed
+    concurrency = max(1, concurrency)
+    plan = ClaimPlan()
+    errors = []
+    processed = 0
 
-            if "all" not in publishers and publisher not in publishers:
+    async def worker():
+        nonlocal processed
+        while (item := await plan.next()) is not None:
+            # Claimed before the interruption, only the code is missing
+            eligibility = item.offer.eligibility
+            if resumed.get(item.offer.id) == CODE_PENDING and eligibility is not None and eligibility.is_claimed:
+                codes.add(await resumed_offer(item, client, headers))
                 continue
 
-            await claim_offer(offer, item["assets"]["externalClaimLink"], client, headers)
+            processed += 1
+            try:
+                claimed = await process_offer_grouped(item, client, headers, publishers, codes)
+            except Exception as e:
+                errors.append(e)
+                claimed = False
+            if claimed is not True:
+                summary.note_unclaimed(item)
 
-async def primelooter(cookie_file, publisher_file):
-    jar = cookiejar.MozillaCookieJar(cookie_file)
-    jar.load()
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        listed = await asyncio.gather(
+            *(
+                offers_list(client, headers, publishers, collection, item_type, plan, settled, summary, resumed)
+                for collection, item_type in COLLECTIONS
+            ),
+            return_exceptions=True,
+        )
+    finally:
+        plan.close(len(workers))
+        await asyncio.gather(*workers)
+        await codes.close()
+        if code_store is not None:
+            code_store.flush()
+
+    summary.deferred = len(plan.deferred)
+    if plan.deferred:
+        log.warning("Time budget used up, %d offers left for the next run.", len(plan.deferred), extra=MAGENTA_LOG)
+        for item in plan.deferred:
+            metrics.inc("offers", outcome="deferred")
+            summary.note_unclaimed(item)
+
+    list_errors = [result for result in listed if isinstance(result, Exception)]
+    if list_errors:
+        raise list_errors[0]
+
+    # Failed offers don't fail the account, they're retried on the next run (planned soon, see plan_next_run)
+    if errors:
+        summary.failed = len(errors)
+        log.warning("%d of %d offers failed, the next run retries them.", len(errors), processed, extra=RED_LOG)
+
+    if ledger is not None:
+        # A run that got through the whole list starts the next one from scratch, except for codes that never
+        # showed up; only one cut short by the time budget is resumed
+        if not plan.deferred:
+            ledger.clear_checkpoint(current_account.get(), keep=codes.timed_out)
+        ledger.commit()
+
+    return summary
+
+
+def account_name(cookie_file: str) -> str:
+    return os.path.splitext(os.path.basename(cookie_file))[0]
+
+
+def find_cookie_files(cookie_files) -> list:
+    if isinstance(cookie_files, (str, os.PathLike)):
+        cookie_files = [cookie_files]
 
-    async with httpx.AsyncClient() as client:
-        base_headers = {
+    found = []
+    for path in cookie_files:
+        if os.path.isdir(path):
+            found.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".txt")))
+        else:
+            found.append(path)
+
+    # The file name keys the account's session, ledger entries and daemon runs, two accounts can't share one
+    unique, names = [], {}
+    for path in found:
+        name = account_name(path)
+        other = names.setdefault(name, path)
+        if other is path:
+            unique.append(path)
+        elif os.path.realpath(other) != os.path.realpath(path):
+            raise ValueError(f"{other} and {path} would both be account {name!r}, rename one of them")
+    return unique
+
+
+COOKIE_FIELDS = (
+    "version",
+    "name",
+    "value",
+    "port",
+    "port_specified",
+    "domain",
+    "domain_specified",
+    "domain_initial_dot",
+    "path",
+    "path_specified",
+    "secure",
+    "expires",
+    "discard",
+    "comment",
+    "comment_url",
+    "rfc2109",
+)
+
+
+class Session:
+    """An account's HTTP client, cookies and CSRF token, kept warm across runs and persisted between restarts.
+
+    A stored token is only checked with the cheap authentication query; /home is scraped when that fails.
+    """
+
+    def __init__(self, cookie_file: str, session_dir: str):
+        self.cookie_file = cookie_file
+        self.name = account_name(cookie_file)
+        self.state_file = os.path.join(session_dir, f"{self.name}.json") if session_dir else None
+        self.client = None
+        self.base_headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/117.0",
         }
-
-        json_headers = base_headers | {
+        self.headers = self.base_headers | {
             "Content-Type": "application/json",
         }
 
+    def load_state(self) -> bool:
+        # A re-exported cookies.txt always wins over what we refreshed ourselves
+        if not self.state_file or not os.path.exists(self.state_file):
+            return False
+        if os.path.getmtime(self.cookie_file) > os.path.getmtime(self.state_file):
+            return False
+
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            cookies = [cookiejar.Cookie(**cookie) for cookie in state["cookies"]]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning("Session: Unable to read %s, starting fresh (%s)", self.state_file, e)
+            return False
+
+        for cookie in cookies:
+            self.client.cookies.jar.set_cookie(cookie)
+        self.headers["csrf-token"] = state["csrf"]
+        return True
+
+    def save_state(self):
+        if not self.state_file:
+            return
+
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        state = {
+            "csrf": self.headers["csrf-token"],
+            "cookies": [
+                {field: getattr(cookie, field) for field in COOKIE_FIELDS} | {"rest": cookie._rest}
+                for cookie in self.client.cookies.jar
+            ],
+        }
+
+        # The file holds live session cookies, keep it private
+        tmp_file = f"{self.state_file}.tmp"
+        with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def discard_state(self):
+        if self.state_file and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    def load_cookie_file(self):
+        jar = cookiejar.MozillaCookieJar(self.cookie_file)
+        jar.load()
+
+        self.client.cookies.clear()
         for _c in jar:
-            client.cookies.jar.set_cookie(_c)
+            self.client.cookies.jar.set_cookie(_c)
 
-        html_body = (await client.get("https://gaming.amazon.com/home", headers=base_headers)).text
+    async def scrape_csrf(self):
+        html_body = (await send(self.client, "GET", home_url, headers=self.base_headers)).text
         matches = re.findall(r"name='csrf-key' value='(.*)'", html_body)
-        json_headers["csrf-token"] = matches[0]
+        self.headers["csrf-token"] = matches[0]
+
+    @metrics.timed("session")
+    async def ensure(self):
+        if self.client is None:
+            self.client = create_client()
+            if not self.load_state():
+                self.load_cookie_file()
+
+        if "csrf-token" not in self.headers:
+            await self.scrape_csrf()
+            await authenticate(self.client, self.headers)
+        else:
+            try:
+                await authenticate(self.client, self.headers)
+            except (AuthException, httpx.HTTPError, LookupError, TypeError, ValueError):
+                log.info("Session: Stored session is no longer valid, signing in again.")
+                self.discard_state()
+                self.load_cookie_file()
+                await self.scrape_csrf()
+                await authenticate(self.client, self.headers)
+
+        self.save_state()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+# Warm sessions by cookie file, reused by every primelooter() call in this process
+sessions = {}
+
+
+def get_session(cookie_file: str, session_dir: str) -> Session:
+    session = sessions.get(cookie_file)
+    if session is None:
+        session = sessions[cookie_file] = Session(cookie_file, session_dir)
+    return session
+
+
+async def close_sessions():
+    for session in sessions.values():
+        await session.close()
+    sessions.clear()
+
+
+async def loot_account(session: Session, publishers, concurrency=4, incremental=False, probe=True):
+    await session.ensure()
+    client, json_headers = session.client, session.headers
+
+    fingerprint = None
+    if probe and ledger is not None:
+        fingerprint, summary = await probe_offers(client, json_headers, publishers)
+        last = ledger.fingerprint(current_account.get(), PROBE_MAX_AGE)
+        if last is not None and last[0] == fingerprint:
+            # A skipped run leaves the same offers unclaimed as the last one, their pre-expiry tries stay planned
+            summary.unclaimed_ends = last[1]
+            now = time.time()
+            retry_due = any(end - pre_expiry_window <= now < end for end in last[1])
+            # Codes left over from an earlier run are worth a full run even if no offer changed, and so is the last
+            # try at offers about to expire
+            if not retry_due and not ledger.checkpoint(current_account.get(), CHECKPOINT_MAX_AGE):
+                log.info("Nothing changed since the last run, skipping.", extra=MAGENTA_LOG)
+                return summary
+
+    summary = await filter_offers(client, json_headers, publishers, concurrency, incremental)
+
+    # Only a run without failures or deferred offers may be skipped next time; otherwise retry until it's settled.
+    # Offers it couldn't claim for good (an account link missing, no publisher) don't change that.
+    # Claims flip offer states, so fingerprint the state after the run rather than before it.
+    if fingerprint is not None:
+        if summary.failed or summary.deferred:
+            ledger.clear_fingerprint(current_account.get())
+        else:
+            fingerprint, _ = await probe_offers(client, json_headers, publishers)
+            ledger.set_fingerprint(current_account.get(), fingerprint, summary.unclaimed_ends)
+
+    session.save_state()
+    return summary
+
+
+async def run_account(session: Session, publishers, concurrency, incremental, probe):
+    current_account.set(session.name)
+
+    try:
+        return await loot_account(session, publishers, concurrency, incremental, probe)
+    except Exception as e:
+        if multiple_accounts:
+            log.error("Account failed: %s", e, extra=RED_LOG)
+        raise
+
+
+async def primelooter(
+    cookie_files,
+    publisher_file,
+    concurrency=4,
+    max_requests=16,
+    cache_file="offer_cache.json",
+    ledger_file="primelooter.db",
+    incremental=False,
+    probe=True,
+    session_dir=".sessions",
+    code_file="game_codes.db",
+    metrics_file=None,
+    batch_size=None,
+    batch_interval=None,
+    time_budget=None,
+    pre_expiry=None,
+    **transport_options,
+) -> RunSummary:
+    global request_limit, offer_cache, ledger, code_store, multiple_accounts, run_deadline, pre_expiry_window
+    run_deadline = time.monotonic() + time_budget if time_budget else None
+    if pre_expiry is not None:
+        pre_expiry_window = pre_expiry
+    transport.update((key, value) for key, value in transport_options.items() if value is not None)
+    # What the limits learned carries over to the next run in this process, unless the settings changed
+    max_requests = max(1, max_requests)
+    if (request_limit.initial, request_limit.adaptive) != (max_requests, transport["adaptive"]):
+        request_limit = AdaptiveLimit(
+            "global", max_requests, maximum=max_requests * LIMIT_HEADROOM, adaptive=transport["adaptive"]
+        )
+        account_limits.clear()
+    batching["size"] = max(1, concurrency if batch_size is None else batch_size)
+    if batch_interval is not None:
+        batching["interval"] = batch_interval
+
+    offer_cache = None
+    if cache_file:
+        # Cached details are only valid for the query and the fields they were fetched with
+        query_hash = hashlib.sha1((offer_query + repr(Item.static_fields)).encode()).hexdigest()
+        offer_cache = OfferCache(cache_file, query_hash)
+        offer_cache.load()
+
+    ledger = Ledger(ledger_file) if ledger_file else None
+    if ledger is not None:
+        game_publishers.update(ledger.game_publishers())
+
+    publishers = FilterRules(publisher_file, blacklist)
+
+    code_store = CodeStore(code_file)
+    imported = code_store.import_legacy_once(LEGACY_CODE_FILE)
+    if imported:
+        log.info("Imported %d codes from %s into %s", imported, LEGACY_CODE_FILE, code_file)
+    metrics.reset_run()
+    for limit in (request_limit, *account_limits.values()):
+        limit.publish()
+    started = time.perf_counter()
+
+    cookie_files = find_cookie_files(cookie_files)
+    multiple_accounts = len(cookie_files) > 1
+
+    try:
+        results = await asyncio.gather(
+            *(
+                run_account(get_session(cookie_file, session_dir), publishers, concurrency, incremental, probe)
+                for cookie_file in cookie_files
+            ),
+            return_exceptions=True,
+        )
+    finally:
+        if offer_cache is not None:
+            offer_cache.save()
+        if ledger is not None:
+            ledger.close()
+        code_store.close()
+        metrics.observe("phase_seconds", time.perf_counter() - started, phase="run")
+        log_transfer_summary()
+        if metrics_file:
+            metrics.write_json(metrics_file)
+
+    # A single failing account must not take the others down; only give up if none of them got through
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors and len(errors) == len(results):
+        raise errors[0]
 
-        await authenticate(client, json_headers)
-        await filter_offers(client, json_headers, publisher_file)
+    summary = RunSummary()
+    for result in results:
+        if isinstance(result, RunSummary):
+            summary.merge(result)
+    return summary
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+import api
+import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def start_server(arg: dict) -> tuple:
+    command = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py"),
+        "--loot",
+        str(arg["loot"]),
+        "--games",
+        str(arg["games"]),
+        "--publishers",
+        str(arg["publishers"]),
+        "--code-delay",
+        str(arg["code_delay"]),
+        "--latency",
+        str(arg["latency"]),
+        "--jitter",
+        str(arg["jitter"]),
+        "--error-rate",
+        str(arg["error_rate"]),
+    ]
+    if arg["fixtures"]:
+        command += ["--fixtures", arg["fixtures"]]
+
+    # The server runs in its own process so it doesn't compete with the looter for the GIL or show up in its memory
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith("Listening on "):
+        server.kill()
+        raise RuntimeError("Mock server did not start")
+    return server, line.removeprefix("Listening on ").strip()
+
+
+def write_cookie_files(directory: str, accounts: int) -> list:
+    cookie_files = []
+    for index in range(accounts):
+        path = os.path.join(directory, f"account{index:03d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("# Netscape HTTP Cookie File\n")
+            f.write(f"127.0.0.1\tFALSE\t/\tFALSE\t{int(time.time()) + 86400 * 365}\tsession-id\tmock-{index}\n")
+        cookie_files.append(path)
+    return cookie_files
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+async def run_benchmark(server_url: str, arg: dict) -> dict:
+    api.gql_url = f"{server_url}/graphql"
+    api.home_url = f"{server_url}/home"
+
+    work_dir = tempfile.mkdtemp(prefix="primelooter-bench-")
+    cookie_dir = os.path.join(work_dir, "cookies")
+    os.makedirs(cookie_dir)
+    write_cookie_files(cookie_dir, arg["accounts"])
+
+    state_files = {
+        "cache_file": os.path.join(work_dir, "offer_cache.json"),
+        "ledger_file": os.path.join(work_dir, "primelooter.db"),
+        "session_dir": os.path.join(work_dir, "sessions"),
+        "code_file": os.path.join(work_dir, "game_codes.db"),
+    }
+
+    runs = []
+    try:
+        async with httpx.AsyncClient() as control:
+            for index in range(arg["runs"]):
+                if arg["fresh"] or index == 0:
+                    await control.post(f"{server_url}/mock/reset")
+                    await api.close_sessions()
+                    api.game_publishers.clear()
+                    for path in state_files.values():
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        elif os.path.exists(path):
+                            os.remove(path)
+
+                if arg["trace_memory"]:
+                    tracemalloc.start()
+
+                started = time.perf_counter()
+                await api.primelooter(
+                    cookie_dir,
+                    arg["publisher_list"],
+                    concurrency=arg["concurrency"],
+                    max_requests=arg["max_requests"],
+                    incremental=arg["incremental"],
+                    probe=arg["probe"],
+                    batch_size=arg["batch_size"],
+                    time_budget=arg["time_budget"],
+                    http2=False,
+                    adaptive=not arg["fixed_requests"],
+                    **state_files,
+                )
+                elapsed = time.perf_counter() - started
+
+                traced_peak = None
+                if arg["trace_memory"]:
+                    traced_peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                    tracemalloc.stop()
+
+                requests = sum(metrics.run.counters_by("requests", "operation").values())
+                received = sum(metrics.run.counters_by("response_bytes", "operation").values())
+                outcomes = metrics.run.counters_by("offers", "outcome")
+                runs.append(
+                    {
+                        "seconds": elapsed,
+                        "requests": requests,
+                        "kilobytes": received / 1024,
+                        "retries": sum(metrics.run.counters_by("retries", "method").values()),
+                        "request_limit": api.request_limit.status()["limit"],
+                        "outcomes": outcomes,
+                        "traced_peak_mb": traced_peak,
+                    }
+                )
+                print(
+                    f"run {index + 1:3d}: {elapsed:7.2f}s  {requests:6d} requests  {received / 1024:9.1f} KB"
+                    + (f"  {traced_peak:7.1f} MB traced" if traced_peak is not None else "")
+                    + f"  claimed {outcomes.get('claimed', 0):.0f}, failed {outcomes.get('failed', 0):.0f}"
+                )
+
+            server_requests = (await control.get(f"{server_url}/mock/stats")).json()
+    finally:
+        await api.close_sessions()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total_seconds = sum(run["seconds"] for run in runs)
+    return {
+        "accounts": arg["accounts"],
+        "offers": arg["loot"] + arg["games"],
+        "runs": runs,
+        "runs_per_second": len(runs) / total_seconds if total_seconds else None,
+        "requests_per_run": sum(run["requests"] for run in runs) / len(runs),
+        "peak_rss_mb": peak_rss_mb(),
+        "server_requests": server_requests,
+    }
+
+
+def print_report(report: dict):
+    runs = report["runs"]
+    print()
+    print(f"{report['accounts']} accounts, {report['offers']} offers, {len(runs)} runs")
+    print(f"runs per second:  {report['runs_per_second']:.3f}")
+    print(f"requests per run: {report['requests_per_run']:.1f}")
+    if len(runs) > 1:
+        # The first run claims everything; the others show the steady state
+        warm = runs[1:]
+        print(
+            f"warm run average: {sum(run['seconds'] for run in warm) / len(warm):.2f}s, "
+            f"{sum(run['requests'] for run in warm) / len(warm):.1f} requests"
+        )
+    if report["peak_rss_mb"] is not None:
+        print(f"peak memory:      {report['peak_rss_mb']:.1f} MB RSS")
+    print(f"server saw:       {json.dumps(report['server_requests'], sort_keys=True)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run primelooter end-to-end against the local mock server")
+    parser.add_argument("--accounts", dest="accounts", help="Number of accounts (default 1)", type=int, default=1)
+    parser.add_argument("--runs", dest="runs", help="Number of runs (default 5)", type=int, default=5)
+    parser.add_argument(
+        "--fresh",
+        dest="fresh",
+        help="Start every run from scratch instead of only the first one",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--loot", dest="loot", help="Number of in-game loot offers (default 200)", type=int, default=200
+    )
+    parser.add_argument("--games", dest="games", help="Number of free game offers (default 20)", type=int, default=20)
+    parser.add_argument(
+        "--publishers", dest="publishers", help="Number of distinct publishers (default 10)", type=int, default=10
+    )
+    parser.add_argument(
+        "--claim-publishers",
+        dest="claim_publishers",
+        help="Only claim offers of this many publishers (default: all)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--code-delay",
+        dest="code_delay",
+        help="Seconds after a claim until its code is available (default 2)",
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--latency", dest="latency", help="Milliseconds added to every response (default 0)", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--jitter", dest="jitter", help="Random extra milliseconds per response (default 0)", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--error-rate",
+        dest="error_rate",
+        help="Share of requests answered with HTTP 429 or 503 (default 0)",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument("--fixtures", dest="fixtures", help="JSON file of recorded responses to replay", default=None)
+    parser.add_argument("--server", dest="server", help="Use an already running mock server at this URL", default=None)
+    parser.add_argument(
+        "-j", "--concurrency", dest="concurrency", help="Offers in parallel (default 4)", type=int, default=4
+    )
+    parser.add_argument(
+        "--max-requests", dest="max_requests", help="Requests in flight (default 16)", type=int, default=16
+    )
+    parser.add_argument(
+        "--fixed-requests",
+        dest="fixed_requests",
+        help="Don't adapt the requests in flight",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        help="Lookups and claims per request (default: the concurrency)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--time-budget", dest="time_budget", help="Seconds a run may start claims for", type=float, default=None
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        dest="incremental",
+        help="Skip offers the ledger has already settled",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--no-probe", dest="probe", help="Don't probe for changes first", action="store_false", default=True
+    )
+    parser.add_argument(
+        "--trace-memory",
+        dest="trace_memory",
+        help="Measure the peak Python heap of each run with tracemalloc (slows the runs down)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument("--json", dest="json", help="Also write the results to this JSON file", default=None)
+    parser.add_argument(
+        "-v", "--verbose", dest="verbose", help="Show the looter's log", action="store_true", default=False
+    )
+
+    arg = vars(parser.parse_args())
+    logging.basicConfig(level=logging.INFO if arg["verbose"] else logging.CRITICAL, format="{message}", style="{")
+
+    if arg["claim_publishers"] is None:
+        arg["publisher_list"] = ["all"]
+    else:
+        arg["publisher_list"] = [f"Mock Publisher {index}" for index in range(arg["claim_publishers"])]
+
+    server = None
+    server_url = arg["server"]
+    if server_url is None:
+        server, server_url = start_server(arg)
+
+    try:
+        report = asyncio.run(run_benchmark(server_url, arg))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if arg["json"]:
+        with open(arg["json"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+
+LEGACY_SEPARATOR = "========================\n========================\n"
+
+
+class CodeStore:
+    """Claimed codes keyed by account and offer id, so re-running never stores a code twice."""
+
+    def __init__(self, path: str = "game_codes.db"):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS codes (
+                account TEXT NOT NULL,
+                offer_id TEXT NOT NULL,
+                item_id TEXT,
+                game_id TEXT,
+                game_title TEXT,
+                title TEXT,
+                name TEXT NOT NULL,
+                code TEXT NOT NULL,
+                instructions TEXT,
+                claimed_at REAL NOT NULL,
+                PRIMARY KEY (account, offer_id)
+            );
+            CREATE INDEX IF NOT EXISTS codes_name ON codes (name COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS codes_claimed_at ON codes (claimed_at);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        self.fts = self.create_search_index()
+        self.db.commit()
+        self.pending = []
+
+    def create_search_index(self) -> bool:
+        # Substring search over the titles; needs SQLite's FTS5 trigram tokenizer (3.34+), LIKE is the fallback
+        exists = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'codes_search'").fetchone()
+        try:
+            self.db.executescript(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS codes_search USING fts5(
+                    name, account UNINDEXED, offer_id UNINDEXED, tokenize = 'trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS codes_search_insert AFTER INSERT ON codes BEGIN
+                    INSERT INTO codes_search (name, account, offer_id) VALUES (new.name, new.account, new.offer_id);
+                END;
+                CREATE TRIGGER IF NOT EXISTS codes_search_delete AFTER DELETE ON codes BEGIN
+                    DELETE FROM codes_search WHERE account = old.account AND offer_id = old.offer_id;
+                END;
+                CREATE TRIGGER IF NOT EXISTS codes_search_update AFTER UPDATE OF name ON codes BEGIN
+                    DELETE FROM codes_search WHERE account = old.account AND offer_id = old.offer_id;
+                    INSERT INTO codes_search (name, account, offer_id) VALUES (new.name, new.account, new.offer_id);
+                END;
+                """
+            )
+        except sqlite3.OperationalError:
+            return False
+
+        if not exists:
+            self.db.execute(
+                "INSERT INTO codes_search (name, account, offer_id) SELECT name, account, offer_id FROM codes"
+            )
+        return True
+
+    def add(self, account: str, item, claimed_at: float = None):
+        self.pending.append(
+            (
+                account,
+                item.offer.id,
+                item.id,
+                item.game_id,
+                item.game_title,
+                item.title,
+                item.name,
+                item.offer.claim_code,
+                (item.claim_instructions or "").replace("\\n", " "),
+                claimed_at or time.time(),
+            )
+        )
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        # Keep the first claim date if a code shows up again
+        self.db.executemany(
+            """
+            INSERT INTO codes (
+                account, offer_id, item_id, game_id, game_title, title, name, code, instructions, claimed_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (account, offer_id) DO UPDATE SET
+                code = excluded.code,
+                instructions = excluded.instructions,
+                name = excluded.name
+            """,
+            self.pending,
+        )
+        # A code imported from game_codes.txt had no offer id; drop it once the real entry is known
+        self.db.executemany(
+            "DELETE FROM codes WHERE offer_id LIKE 'legacy:%' AND name = ? AND code = ?",
+            [(row[6], row[7]) for row in self.pending],
+        )
+        self.db.commit()
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def filter(self, text: str = None, since: float = None, until: float = None) -> tuple:
+        joins, where, params = "", [], []
+        if text and self.fts and len(text) >= 3:
+            joins = " JOIN codes_search s ON s.account = codes.account AND s.offer_id = codes.offer_id"
+            where.append("codes_search MATCH ?")
+            params.append('"' + text.replace('"', '""') + '"')
+        elif text:
+            where.append("codes.name LIKE ?")
+            params.append(f"%{text}%")
+        if since is not None:
+            where.append("codes.claimed_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("codes.claimed_at < ?")
+            params.append(until)
+
+        return joins + (" WHERE " + " AND ".join(where) if where else ""), params
+
+    def search(self, text: str = None, since: float = None, until: float = None, limit: int = -1, offset: int = 0):
+        clause, params = self.filter(text, since, until)
+        query = f"SELECT codes.* FROM codes{clause} ORDER BY codes.name COLLATE NOCASE LIMIT ? OFFSET ?"
+        return self.db.execute(query, params + [limit, offset]).fetchall()
+
+    def count(self, text: str = None, since: float = None, until: float = None) -> int:
+        clause, params = self.filter(text, since, until)
+        return self.db.execute(f"SELECT COUNT(*) FROM codes{clause}", params).fetchone()[0]
+
+    def data_version(self) -> int:
+        # Changes whenever another connection (a running looter) commits to the database
+        return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def import_legacy(self, path: str, account: str = "") -> int:
+        """Import a game_codes.txt written by older versions; running it again adds nothing new."""
+        with open(path, "r", encoding="utf-8") as f:
+            entries = f.read().split(LEGACY_SEPARATOR)
+
+        claimed_at = os.path.getmtime(path)
+        rows = []
+        for entry in entries:
+            lines = entry.strip().split("\n")
+            name, _, code = lines[0].partition("Code:")
+            name, code = name.strip(), code.strip()
+            if not name or not code:
+                continue
+
+            # Old entries carry no offer id, derive a stable one from what they do carry
+            offer_id = "legacy:" + hashlib.sha1(f"{name}\n{code}".encode()).hexdigest()
+            instructions = "\n".join(lines[1:]).strip()
+            rows.append((account, offer_id, None, None, None, None, name, code, instructions, claimed_at, name, code))
+
+        # A code already stored, from an earlier import or by its real offer since, isn't added again
+        # Counted in rows, total_changes would include what the search index triggers write
+        before = self.count()
+        self.db.executemany(
+            """
+            INSERT OR IGNORE INTO codes (
+                account, offer_id, item_id, game_id, game_title, title, name, code, instructions, claimed_at
+            ) SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM codes WHERE name = ? AND code = ?)
+            """,
+            rows,
+        )
+        self.db.commit()
+        return self.count() - before
+
+    def import_legacy_once(self, path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            return 0
+
+        imported = self.import_legacy(path)
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', ?)", (path,))
+        self.db.commit()
+        return imported
+
+    def export_text(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for row in self.search():
+                f.write(f"{row['name']} Code: {row['code']}\n\n{row['instructions']}\n{LEGACY_SEPARATOR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up, import and export claimed game codes")
+    parser.add_argument("--db", dest="db", help="Path to the code store", default="game_codes.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Import a game_codes.txt from older versions")
+    import_parser.add_argument("path", nargs="?", default="game_codes.txt")
+    import_parser.add_argument("--account", default="")
+
+    export_parser = commands.add_parser("export", help="Write all codes in the game_codes.txt format")
+    export_parser.add_argument("path", nargs="?", default="game_codes.txt")
+
+    search_parser = commands.add_parser("search", help="Find codes by title and claim date")
+    search_parser.add_argument("text", nargs="?")
+    search_parser.add_argument("--since", help="YYYY-MM-DD")
+    search_parser.add_argument("--until", help="YYYY-MM-DD")
+
+    arg = parser.parse_args()
+    store = CodeStore(arg.db)
+
+    if arg.command == "import":
+        print(f"Imported {store.import_legacy(arg.path, arg.account)} codes from {arg.path}")
+    elif arg.command == "export":
+        store.export_text(arg.path)
+        print(f"Exported codes to {arg.path}")
+    else:
+        since = time.mktime(time.strptime(arg.since, "%Y-%m-%d")) if arg.since else None
+        until = time.mktime(time.strptime(arg.until, "%Y-%m-%d")) if arg.until else None
+        for row in store.search(arg.text, since, until):
+            claimed = time.strftime("%Y-%m-%d", time.localtime(row["claimed_at"]))
+            print(f"{claimed}  {row['name']}: {row['code']}")
+
+    store.close()
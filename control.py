@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.parse
+from api import account_name, find_cookie_files, request_limits
+import metrics
+
+log = logging.getLogger()
+
+# Seconds until a failed scheduled run is tried again, like the --loop mode does
+RETRY_DELAY = 60
+
+
+class Daemon:
+    """Keeps one process (and its warm sessions) alive and runs loot passes on schedule or when asked to.
+
+    Runs never overlap: triggers that arrive during a run are queued and merged into the next one.
+    """
+
+    def __init__(self, cookie_files, run, plan=None):
+        self.cookie_files = cookie_files
+        self.run = run
+        self.plan = plan
+        self.queued = set()
+        self.waiters = []
+        self.wakeup = asyncio.Event()
+        self.runs = 0
+        self.current = None
+        self.last = None
+        self.next_run = time.time() if plan is not None else None
+
+    def accounts(self) -> dict:
+        # Re-read every time so cookie files dropped into a directory are picked up without a restart
+        try:
+            return {account_name(path): path for path in find_cookie_files(self.cookie_files)}
+        except ValueError as e:
+            log.error("Daemon: %s", e)
+            return {}
+
+    def trigger(self, names=None) -> asyncio.Future:
+        accounts = self.accounts()
+        names = list(accounts) if not names else names
+        unknown = [name for name in names if name not in accounts]
+        if unknown:
+            raise KeyError(f"Unknown account(s): {', '.join(unknown)}")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queued.update(names)
+        self.waiters.append(waiter)
+        self.wakeup.set()
+        return waiter
+
+    def status(self) -> dict:
+        current = None
+        if self.current is not None:
+            current = self.current | {
+                "seconds": time.time() - self.current["started"],
+                "outcomes": metrics.run.counters_by("offers", "outcome"),
+                "requests": sum(metrics.run.counters_by("requests", "operation").values()),
+            }
+        return {
+            "state": "running" if self.current is not None else "idle",
+            "accounts": sorted(self.accounts()),
+            "current": current,
+            "queued": sorted(self.queued),
+            "next_run": self.next_run,
+            "last": self.last,
+            "request_limits": request_limits(),
+        }
+
+    async def loop(self):
+        while True:
+            if not self.queued:
+                timeout = None if self.next_run is None else max(0.0, self.next_run - time.time())
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    self.queued.update(self.accounts())
+                    trigger = "schedule"
+                else:
+                    trigger = "request"
+            else:
+                trigger = "request"
+
+            self.wakeup.clear()
+            names, self.queued = sorted(self.queued), set()
+            waiters, self.waiters = self.waiters, []
+            if not names:
+                continue
+
+            result = await self.execute(names, trigger)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(result)
+
+    async def execute(self, names: list, trigger: str) -> dict:
+        accounts = self.accounts()
+        full_run = set(names) >= set(accounts)
+        self.runs += 1
+        self.current = {"id": self.runs, "accounts": names, "trigger": trigger, "started": time.time()}
+        log.info("Daemon: Run %d (%s) for %s", self.runs, trigger, ", ".join(names))
+
+        summary, error = None, None
+        try:
+            summary = await self.run([accounts[name] for name in names if name in accounts])
+        except Exception as e:
+            log.error("Daemon: Run %d failed: %s", self.runs, e)
+            error = str(e) or repr(e)
+
+        finished = time.time()
+        self.last = self.current | {
+            "finished": finished,
+            "seconds": finished - self.current["started"],
+            "ok": error is None,
+            "error": error,
+            "next_offer_start": summary.next_start if summary is not None else None,
+            "unclaimed": len(summary.unclaimed_ends) if summary is not None else None,
+            "failed": summary.failed if summary is not None else None,
+            "outcomes": metrics.run.counters_by("offers", "outcome"),
+            "requests": sum(metrics.run.counters_by("requests", "operation").values()),
+        }
+        self.current = None
+
+        # Only a run over every account says enough to plan the next scheduled one
+        if self.plan is not None and full_run:
+            self.next_run = self.plan(summary) if summary is not None else finished + RETRY_DELAY
+            log.info("Daemon: Next run at %s.", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.next_run)))
+        return self.last
+
+    async def handle(self, method: str, target: str) -> tuple:
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+
+        if method == "GET" and url.path == "/status":
+            return 200, self.status()
+        if method == "GET" and url.path == "/summary":
+            if self.last is None:
+                return 404, {"error": "No run has finished yet"}
+            return 200, self.last
+        if method == "POST" and url.path == "/run":
+            try:
+                waiter = self.trigger(query.get("account"))
+            except KeyError as e:
+                return 404, {"error": e.args[0]}
+            if query.get("wait", ["0"])[0] not in ("", "0", "false"):
+                return 200, await waiter
+            return 202, {"queued": sorted(self.queued), "running": self.current}
+        return 404, {"error": f"No route for {method} {url.path}"}
+
+
+REASONS = {200: "OK", 202: "Accepted", 404: "Not Found"}
+
+
+async def serve_control(daemon: Daemon, port: int = None, socket_path: str = None, host: str = "127.0.0.1"):
+    async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode()
+            length = 0
+            while line := (await reader.readline()).strip():
+                name, _, value = line.decode().partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+
+            method, target = request_line.split()[:2]
+            status, payload = await daemon.handle(method, target)
+            body = json.dumps(payload, indent=2).encode()
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(connection, socket_path)
+        # Anyone who can talk to the socket can start runs, keep it to this user
+        os.chmod(socket_path, 0o600)
+        log.info("Daemon: Control API listening on %s", socket_path)
+    else:
+        server = await asyncio.start_server(connection, host, port)
+        log.info("Daemon: Control API listening on http://%s:%d", host, port)
+    return server
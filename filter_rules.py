@@ -0,0 +1,87 @@
+import re
+
+ALL = "all"
+DENY = "!"
+REGEX = "re:"
+TITLE = "title:"
+
+
+# Flags at the start of a pattern, like (?i), which only work at the start of the combined regex
+GLOBAL_FLAGS = re.compile(r"\(\?([aiLmsux]+)\)")
+
+
+def compile_patterns(patterns: list):
+    if not patterns:
+        return None
+    # Every pattern keeps its flags to itself as a scoped group: (?i)abc becomes (?i:abc)
+    groups = []
+    for pattern in patterns:
+        flags = GLOBAL_FLAGS.match(pattern)
+        groups.append(f"(?{flags.group(1)}:{pattern[flags.end():]})" if flags else f"(?:{pattern})")
+    return re.compile("|".join(groups))
+
+
+class FilterRules:
+    """publishers.txt compiled into set lookups and one regex per rule kind, so filtering an item is O(1).
+
+    Lines are publisher names (``all`` for every publisher) or ``re:`` patterns matched against the publisher.
+    A leading ``!`` turns a line into a deny rule, which always wins; ``!title:`` rules drop offers by their
+    title or game title. Empty lines and lines starting with ``#`` are ignored.
+    """
+
+    def __init__(self, lines, title_blacklist=()):
+        self.lines = [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+        self.allow_all = False
+        allow, deny, titles = set(), set(), set(title_blacklist)
+        allow_patterns, deny_patterns, title_patterns = [], [], []
+
+        for line in self.lines:
+            denied = line.startswith(DENY)
+            rule = line.removeprefix(DENY).strip() if denied else line
+
+            if rule.startswith(TITLE):
+                if not denied:
+                    raise ValueError(f"Title rules can only exclude offers, use !{line}")
+                names, patterns, rule = titles, title_patterns, rule.removeprefix(TITLE).strip()
+            elif denied:
+                names, patterns = deny, deny_patterns
+            else:
+                names, patterns = allow, allow_patterns
+
+            if rule.startswith(REGEX):
+                pattern = rule.removeprefix(REGEX).strip()
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise ValueError(f"Invalid pattern in {line!r}: {e}") from None
+                patterns.append(pattern)
+            elif rule == ALL and names is allow:
+                self.allow_all = True
+            else:
+                names.add(rule)
+
+        self.allow = frozenset(allow)
+        self.deny = frozenset(deny)
+        self.titles = frozenset(titles)
+        self.allow_pattern = compile_patterns(allow_patterns)
+        self.deny_pattern = compile_patterns(deny_patterns)
+        self.title_pattern = compile_patterns(title_patterns)
+
+    def publisher_allowed(self, publisher: str) -> bool:
+        if publisher is None:
+            return False
+        if publisher in self.deny or (self.deny_pattern is not None and self.deny_pattern.search(publisher)):
+            return False
+        return (
+            self.allow_all
+            or publisher in self.allow
+            or (self.allow_pattern is not None and self.allow_pattern.search(publisher) is not None)
+        )
+
+    def title_excluded(self, *titles) -> bool:
+        for title in titles:
+            if title is None:
+                continue
+            if title in self.titles or (self.title_pattern is not None and self.title_pattern.search(title)):
+                return True
+        return False
@@ -1,59 +1,144 @@
 import tkinter as tk
 from tkinter import messagebox
+from code_store import CodeStore
+
+# How often the code store is checked for codes written by a running looter (ms)
+REFRESH_INTERVAL = 2000
+# Delay between the last keystroke and running the search (ms)
+SEARCH_DELAY = 150
+
+store = CodeStore("game_codes.db")
+
 
 def load_instructions():
-    with open("game_codes.txt", "r", encoding="utf-8") as file:
-        instructions = file.read()
-    return instructions
+    # Only the rows that are on screen are ever read from the store
+    rows = store.search(view['filter'], limit=visible_rows(), offset=view['offset'])
+    data.clear()
+    data.extend(
+        {
+            'key': (row['account'], row['offer_id']),
+            'title': row['name'],
+            'code': row['code'],
+            'instructions': row['instructions'],
+        }
+        for row in rows
+    )
+
+
+def visible_rows():
+    row_height = list_box.bbox(0)[3] if list_box.size() and list_box.bbox(0) else 16
+    return max(1, list_box.winfo_height() // max(1, row_height))
+
 
 def display_instructions(event=None):
-    instructions = load_instructions()
-    entries = instructions.split("========================\n========================\n")
+    rows = visible_rows()
+    view['offset'] = max(0, min(view['offset'], view['total'] - rows))
+    load_instructions()
+
+    # Refilling the list drops its selection; the selected code is kept by its offer and selected again if visible
+    list_box.delete(0, tk.END)
+    selected = view['selected']
+    for index, entry in enumerate(data):
+        list_box.insert(tk.END, entry['title'])
+        if selected is not None and entry['key'] == selected['key']:
+            list_box.selection_set(index)
+
+    if view['total']:
+        scrollbar.set(view['offset'] / view['total'], min(1.0, (view['offset'] + rows) / view['total']))
+    else:
+        scrollbar.set(0.0, 1.0)
+    root.title(f"Game Codes Viewer ({view['total']} codes)")
+
+
+def refresh_count():
+    view['total'] = store.count(view['filter'])
+
+
+def scroll(action, amount, unit=None):
+    rows = visible_rows()
+    if action == "moveto":
+        view['offset'] = int(float(amount) * view['total'])
+    elif unit == "pages":
+        view['offset'] += int(amount) * rows
+    else:
+        view['offset'] += int(amount)
+    display_instructions()
+
+
+def scroll_wheel(event):
+    if getattr(event, "num", None) == 4 or event.delta > 0:
+        scroll("scroll", -3)
+    else:
+        scroll("scroll", 3)
+
+
+def search_changed(*args):
+    if view['pending_search'] is not None:
+        root.after_cancel(view['pending_search'])
+    view['pending_search'] = root.after(SEARCH_DELAY, run_search)
+
+
+def run_search():
+    view['pending_search'] = None
+    view['filter'] = search_text.get().strip() or None
+    view['offset'] = 0
+    refresh_count()
+    display_instructions()
+
+
+def watch_store():
+    # Pick up codes written since the last check without reloading anything off screen
+    version = store.data_version()
+    if version != view['version']:
+        view['version'] = version
+        refresh_count()
+        display_instructions()
+    root.after(REFRESH_INTERVAL, watch_store)
 
-    data.clear()
-    sorted_entries = sorted(entries, key=lambda x: x.split('\n')[0].split("Code:")[0].strip())
-    for entry in sorted_entries:
-        lines = entry.strip().split('\n')
-        title_line = lines[0].split("Code:")
-        title = title_line[0].strip()
-        if len(title_line) > 1:
-            code = title_line[1].strip()
-        else:
-            code = "None"
-        list_box.insert(tk.END, title)
-        data.append({'title': title, 'code': code, 'instructions': '\n'.join(lines[1:]).strip()})
 
 def copy_code():
-    selected_index = list_box.curselection()
-    if selected_index:
-        selected_item = data[selected_index[0]]
-        code = selected_item['code']
+    # The code whose instructions are shown, even while it's scrolled out of view
+    if view['selected'] is not None:
+        code = view['selected']['code']
         root.clipboard_clear()
         root.clipboard_append(code)
         messagebox.showinfo("Code Copied", f"The code '{code}' has been copied to the clipboard.")
 
+
 def show_instructions(event=None):
     selected_index = list_box.curselection()
     if selected_index:
-        selected_item = data[selected_index[0]]
+        selected_item = view['selected'] = data[selected_index[0]]
         instructions = selected_item['instructions']
         text_box.delete("1.0", tk.END)
         text_box.insert(tk.END, instructions)
 
+
 # Create the main window
 root = tk.Tk()
 root.title("Game Codes Viewer")
 
-# Create a Listbox widget to display titles
-list_box = tk.Listbox(root, width=50, height=20)
-list_box.pack(side=tk.LEFT, fill=tk.BOTH, padx=5, pady=5, expand=True)
+# Create a search field above the list
+left_frame = tk.Frame(root)
+left_frame.pack(side=tk.LEFT, fill=tk.BOTH, padx=5, pady=5, expand=True)
+search_text = tk.StringVar()
+search_text.trace_add("write", search_changed)
+search_entry = tk.Entry(left_frame, textvariable=search_text)
+search_entry.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+
+# Create a Listbox widget to display titles; it only ever holds the visible rows
+list_box = tk.Listbox(left_frame, width=50, height=20, exportselection=False)
+list_box.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 list_box.bind("<<ListboxSelect>>", show_instructions)
+list_box.bind("<Configure>", display_instructions)
+list_box.bind("<MouseWheel>", scroll_wheel)
+list_box.bind("<Button-4>", scroll_wheel)
+list_box.bind("<Button-5>", scroll_wheel)
 
-# Create a scrollbar for the Listbox
-scrollbar = tk.Scrollbar(root, orient=tk.VERTICAL)
+# Create a scrollbar for the Listbox, driven by the position in the whole result set
+scrollbar = tk.Scrollbar(left_frame, orient=tk.VERTICAL)
 scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-scrollbar.config(command=list_box.yview)
-list_box.config(yscrollcommand=scrollbar.set)
+scrollbar.config(command=scroll)
 
 # Create a Text widget to display instructions
 text_box = tk.Text(root, wrap="word", height=20, width=80)
@@ -63,11 +148,16 @@ text_box.pack(side=tk.LEFT, fill=tk.BOTH, padx=5, pady=5, expand=True)
 copy_button = tk.Button(root, text="Copy Code", command=copy_code)
 copy_button.pack(side=tk.BOTTOM, padx=5, pady=5)
 
-# Initialize data structure to store instructions
+# Initialize data structure to store the visible entries and the position in the list
 data = []
+view = {'filter': None, 'offset': 0, 'total': 0, 'version': None, 'pending_search': None, 'selected': None}
 
 # Load instructions initially
+store.import_legacy_once("game_codes.txt")
+refresh_count()
 display_instructions()
+watch_store()
 
 # Run the GUI
 root.mainloop()
+store.close()
@@ -0,0 +1,75 @@
+import codecs
+import json
+import re
+
+# A complete string (a key if a colon follows), an unterminated string, or a bracket
+TOKENS = re.compile(r'"((?:[^"\\]|\\.)*)"(\s*:)?\s*|"|[{}\[\]]', re.DOTALL)
+
+# Path element standing for every element of an array
+ANY = "*"
+
+decoder = json.JSONDecoder()
+
+
+class JsonStream:
+    """Pulls the objects and arrays at the given paths out of a JSON document while it is still arriving.
+
+    Paths are tuples of keys, with ``ANY`` for array elements: ``("data", "items", "items", ANY)`` is every element
+    of ``data.items.items``. Everything around those values is only scanned for keys and brackets, and only the value
+    being read and the unscanned tail of the last chunk are kept in memory.
+    """
+
+    def __init__(self, paths):
+        self.paths = {tuple(path) for path in paths}
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.stack = []
+        self.key = None
+
+    def feed(self, chunk: bytes) -> list:
+        """Scan the next chunk and return the (path, value) pairs it completed."""
+        buffer = self.buffer + self.text.decode(chunk)
+        position = 0
+        found = []
+
+        while match := TOKENS.search(buffer, position):
+            token = match.group()
+            if token == '"':
+                # The string goes on in the next chunk
+                break
+            if token[0] == '"':
+                if match.group(2):
+                    self.key = match.group(1)
+                elif match.end() == len(buffer):
+                    # Can't tell a value from a key whose colon is still on its way
+                    break
+            elif token in "{[":
+                if not self.stack:
+                    path = ()
+                elif self.stack[-1][1] == "{":
+                    path = self.stack[-1][0] + (self.key,)
+                else:
+                    path = self.stack[-1][0] + (ANY,)
+
+                if path in self.paths:
+                    # The C decoder reads the whole value; if it isn't complete yet, try again with the next chunk
+                    try:
+                        value, end = decoder.raw_decode(buffer, match.start())
+                    except json.JSONDecodeError:
+                        position = match.start()
+                        break
+                    found.append((path, value))
+                    position = end
+                    continue
+                self.stack.append((path, token))
+            else:
+                self.stack.pop()
+            position = match.end()
+
+        # Drop everything that is scanned, only the start of an unfinished value or token stays
+        self.buffer = buffer[position:]
+        return found
+
+    def close(self):
+        if self.buffer.strip() or self.stack:
+            raise ValueError("The JSON document ended early or isn't valid")
@@ -0,0 +1,162 @@
+import json
+import sqlite3
+import time
+
+CLAIMED = "claimed"
+SKIPPED_PUBLISHER = "skipped_publisher"
+NEEDS_LINK = "needs_link"
+CODE_RETRIEVED = "code_retrieved"
+
+# Checkpoint steps: the offer needs nothing more this run, or it's claimed and its code is still to be fetched
+DONE = "done"
+CODE_PENDING = "code_pending"
+
+
+class Ledger:
+    """Per-account record of what happened to each offer, so later runs can leave settled offers alone."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        # Checkpoints are committed one by one; WAL keeps that cheap
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS offers (
+                account TEXT NOT NULL,
+                offer_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                title TEXT,
+                publisher TEXT,
+                updated REAL NOT NULL,
+                PRIMARY KEY (account, offer_id)
+            )
+            """
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                account TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                unclaimed_ends TEXT,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        # Ledgers from before unclaimed_ends
+        if "unclaimed_ends" not in {row[1] for row in self.db.execute("PRAGMA table_info(fingerprints)")}:
+            self.db.execute("ALTER TABLE fingerprints ADD COLUMN unclaimed_ends TEXT")
+        # Account-independent: which publisher a game belongs to, learned from detail responses
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS game_publishers (
+                game_id TEXT PRIMARY KEY,
+                publisher TEXT NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        # The current run's progress per account, so a crashed or failed run resumes instead of starting over
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                account TEXT NOT NULL,
+                offer_id TEXT NOT NULL,
+                step TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (account, offer_id)
+            )
+            """
+        )
+        self.db.commit()
+
+    def game_publishers(self) -> dict:
+        return dict(self.db.execute("SELECT game_id, publisher FROM game_publishers"))
+
+    def set_game_publisher(self, game_id: str, publisher: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO game_publishers (game_id, publisher, updated) VALUES (?, ?, ?)",
+            (game_id, publisher, time.time()),
+        )
+
+    def fingerprint(self, account: str, max_age: float):
+        # The fingerprint and the end times of the offers that run left unclaimed
+        row = self.db.execute(
+            "SELECT fingerprint, unclaimed_ends, updated FROM fingerprints WHERE account = ?", (account,)
+        ).fetchone()
+        if row is None or row[2] < time.time() - max_age:
+            return None
+        return row[0], json.loads(row[1] or "[]")
+
+    def set_fingerprint(self, account: str, fingerprint: str, unclaimed_ends=()):
+        self.db.execute(
+            "INSERT OR REPLACE INTO fingerprints (account, fingerprint, unclaimed_ends, updated) VALUES (?, ?, ?, ?)",
+            (account, fingerprint, json.dumps(sorted(unclaimed_ends)), time.time()),
+        )
+
+    def clear_fingerprint(self, account: str):
+        self.db.execute("DELETE FROM fingerprints WHERE account = ?", (account,))
+
+    def states(self, account: str) -> dict:
+        rows = self.db.execute("SELECT offer_id, state, publisher FROM offers WHERE account = ?", (account,))
+        return {offer_id: (state, publisher) for offer_id, state, publisher in rows}
+
+    def record(self, account: str, offer_id: str, state: str, title: str = None, publisher: str = None):
+        # A retrieved code is final, don't let a later "claimed" overwrite it
+        self.db.execute(
+            """
+            INSERT INTO offers (account, offer_id, state, title, publisher, updated) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (account, offer_id) DO UPDATE SET
+                state = excluded.state,
+                title = COALESCE(excluded.title, offers.title),
+                publisher = COALESCE(excluded.publisher, offers.publisher),
+                updated = excluded.updated
+            WHERE offers.state != 'code_retrieved'
+            """,
+            (account, offer_id, state, title, publisher, time.time()),
+        )
+
+    def checkpoint(self, account: str, max_age: float = None) -> dict:
+        # Pending codes are kept until they show up; what a run finished only matters to a run resumed soon after
+        oldest = time.time() - max_age if max_age is not None else 0
+        rows = self.db.execute(
+            "SELECT offer_id, step FROM checkpoints WHERE account = ? AND (step != ? OR updated >= ?)",
+            (account, DONE, oldest),
+        )
+        return dict(rows)
+
+    def set_checkpoint(self, account: str, offer_id: str, step: str):
+        # Committed right away together with everything recorded so far, that's what makes it survive a crash
+        self.db.execute(
+            "INSERT OR REPLACE INTO checkpoints (account, offer_id, step, updated) VALUES (?, ?, ?, ?)",
+            (account, offer_id, step, time.time()),
+        )
+        self.db.commit()
+
+    def clear_checkpoint(self, account: str, keep=()):
+        keep = list(keep)
+        self.db.execute(
+            f"DELETE FROM checkpoints WHERE account = ? AND offer_id NOT IN ({', '.join('?' * len(keep))})",
+            (account, *keep),
+        )
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def is_settled(entry, rules) -> bool:
+    if entry is None:
+        return False
+
+    state, publisher = entry
+    if state in (CLAIMED, CODE_RETRIEVED):
+        return True
+    # Skipped offers come back into play as soon as their publisher is added to publishers.txt
+    if state == SKIPPED_PUBLISHER:
+        return not rules.publisher_allowed(publisher)
+    return False
@@ -0,0 +1,82 @@
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import time
+
+TEXT_FORMAT = "{asctime} [{levelname}] {account_prefix}{color_start}{message}{color_end}"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+RESET = "\033[0m"
+ANSI = re.compile(r"\033\[[0-9;]*m")
+
+
+class TextFormatter(logging.Formatter):
+    """The usual log line; colours passed with extra={"color": ...} are only applied when asked to."""
+
+    def __init__(self, color: bool):
+        super().__init__(TEXT_FORMAT, DATE_FORMAT, style="{")
+        self.color = color
+
+    def format(self, record: logging.LogRecord) -> str:
+        color = getattr(record, "color", None) if self.color else None
+        record.color_start, record.color_end = (color, RESET) if color else ("", "")
+        if not hasattr(record, "account_prefix"):
+            record.account_prefix = ""
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, account and the plain message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "account": getattr(record, "account", None),
+            "message": ANSI.sub("", record.getMessage()).strip(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are instead of pre-formatting them, which only cross-process queues need; the message
+    and the traceback are then formatted on the listener's thread, with ``exc_info`` intact."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(
+    log_format: str = "text", log_file: str = "primelooter.log", level: int = logging.INFO, filters=()
+) -> logging.handlers.QueueListener:
+    """Route the root logger through a queue; formatting and writing happen on the listener's thread.
+
+    ``filters`` run on the logging thread before a record is queued, so they still see context variables.
+    """
+    stream_handler = logging.StreamHandler(sys.stdout)
+    file_handler = logging.FileHandler(log_file)
+    if log_format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter(color=True))
+        file_handler.setFormatter(TextFormatter(color=False))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    for record_filter in filters:
+        queue_handler.addFilter(record_filter)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    return listener
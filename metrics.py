@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import json
+import logging
+import math
+import time
+
+log = logging.getLogger()
+
+# Upper bounds in seconds, shared by every latency histogram
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class Registry:
+    """Counters, gauges and latency histograms, keyed by metric name and a sorted tuple of label pairs."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, amount: float, labels: tuple):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, labels: tuple):
+        self.gauges[(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: tuple):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def counters_by(self, name: str, label: str) -> dict:
+        values = {}
+        for (metric, labels), value in self.counters.items():
+            if metric == name:
+                key = dict(labels).get(label)
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def to_json(self) -> dict:
+        return {
+            "started": self.started,
+            "finished": time.time(),
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.gauges.items())
+            ],
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": {
+                        ("+Inf" if bound == math.inf else bound): count
+                        for bound, count in zip(BUCKETS, histogram.counts)
+                    },
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"primelooter_{name}_total{format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"primelooter_{name}{format_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"primelooter_{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"primelooter_{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"primelooter_{name}_count{format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+# Everything since the process started (what Prometheus scrapes) and just the current run (the JSON file)
+total = Registry()
+run = Registry()
+
+
+def reset_run():
+    global run
+    run = Registry()
+
+
+def inc(name: str, amount: float = 1, **labels):
+    labels = tuple(sorted(labels.items()))
+    total.inc(name, amount, labels)
+    run.inc(name, amount, labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    labels = tuple(sorted(labels.items()))
+    total.set_gauge(name, value, labels)
+    run.set_gauge(name, value, labels)
+
+
+def observe(name: str, value: float, **labels):
+    labels = tuple(sorted(labels.items()))
+    total.observe(name, value, labels)
+    run.observe(name, value, labels)
+
+
+def timed(phase: str):
+    """Record how long each call of the decorated coroutine takes under phase_seconds{phase=...}."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe("phase_seconds", time.perf_counter() - started, phase=phase)
+
+        return wrapper
+
+    return decorator
+
+
+def write_json(path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run.to_json(), f, indent=2)
+
+
+async def serve_prometheus(port: int, host: str = "127.0.0.1"):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+
+            if request_line.split()[1:2] == [b"/metrics"]:
+                status, body = "200 OK", total.to_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    log.info("Metrics: Serving Prometheus metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,396 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+COLLECTION_TYPES = {"LOOT": "inGameLoot", "FREE_GAMES": "games"}
+
+# The collection of a listing that has it in the query instead of a variable: items(collectionType: LOOT, ...)
+LITERAL_COLLECTION = re.compile(r"\bcollectionType: (\w+)")
+
+# Batched requests repeat one field under aliases: b0: itemV2(itemId: $itemId0, ...) { ... }
+ALIASED_FIELD = re.compile(r"\b(b\d+): (\w+)\((\w+): \$(\w+)")
+
+
+class MockPrimeGaming:
+    """A stand-in for the Prime Gaming GraphQL API with generated offers and per-account claim state.
+
+    Accounts are told apart by the CSRF token handed out on /home. Recorded fixtures, when given, are answered
+    before anything is generated.
+    """
+
+    def __init__(
+        self,
+        loot=200,
+        games=20,
+        publishers=10,
+        code_ratio=0.3,
+        link_ratio=0.05,
+        code_delay=2.0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        paging=True,
+        fixtures=None,
+        seed=0,
+    ):
+        self.paging = paging
+        self.code_delay = code_delay
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.fixtures = {}
+        for fixture in fixtures or []:
+            self.fixtures.setdefault(fixture["operationName"], []).append(fixture)
+
+        now = time.time()
+        self.collections = {"inGameLoot": [], "games": []}
+        self.items = {}
+        for collection, count in (("inGameLoot", loot), ("games", games)):
+            kind = "loot" if collection == "inGameLoot" else "game"
+            for index in range(count):
+                game = index % max(1, publishers * 3)
+                item = {
+                    "id": f"amzn1.pg.item.{kind}-{index}",
+                    "grantsCode": self.random.random() < code_ratio,
+                    "priority": index,
+                    "assets": {
+                        "id": f"{kind}-asset-{index}",
+                        "title": f"Mock {kind.title()} {index}",
+                        "externalClaimLink": f"https://example.com/link/{kind}-{index}",
+                        "claimInstructions": f"Redeem the code for mock {kind} {index}.",
+                    },
+                    "game": {
+                        "id": f"game-{game}",
+                        "assets": {
+                            "title": f"Mock Game {game}",
+                            "publisher": f"Mock Publisher {game % max(1, publishers)}",
+                        },
+                    },
+                    "offers": [
+                        {
+                            "id": f"{kind}-offer-{index}",
+                            "startTime": format_time(now - 86400),
+                            "endTime": format_time(now + 86400 * 7 + index * 60),
+                        }
+                    ],
+                }
+                self.collections[collection].append(item)
+                self.items[item["assets"]["id"]] = (item, self.random.random() < link_ratio)
+
+        self.accounts = {}
+        self.requests = {}
+
+    def reset(self):
+        self.accounts = {}
+        self.requests = {}
+
+    def account(self, token: str) -> dict:
+        # offer id -> time it was claimed
+        return self.accounts.setdefault(token, {})
+
+    def count(self, operation: str):
+        self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def new_token(self) -> str:
+        return f"mock-csrf-{len(self.accounts)}-{self.random.getrandbits(32):08x}"
+
+    def fixture(self, body: dict):
+        for fixture in self.fixtures.get(body.get("operationName"), []):
+            variables = fixture.get("variables") or {}
+            if all(body.get("variables", {}).get(name) == value for name, value in variables.items()):
+                return fixture["response"]
+        return None
+
+    def offer_state(self, item: dict, claims: dict, link_required: bool, details: bool) -> dict:
+        offer_id = item["offers"][0]["id"]
+        eligibility = {"offerState": "LIVE", "isClaimed": offer_id in claims}
+        if details:
+            eligibility["canClaim"] = offer_id not in claims and not link_required
+            eligibility["missingRequiredAccountLink"] = link_required
+
+        # Codes only show up a while after the claim, like the real site
+        claimed_at = claims.get(offer_id)
+        order_information = None
+        if claimed_at is not None and item["grantsCode"] and time.time() >= claimed_at + self.code_delay:
+            order_information = [{"claimCode": f"MOCK-{offer_id.upper()}", "orderState": "FULFILLED"}]
+
+        return {"eligibility": eligibility, "orderInformation": order_information}
+
+    def list_items(self, items: list, claims: dict, probe: bool, fields: set) -> list:
+        # Like the real API, assets only carry the fields the query selects
+        def selected(assets: dict) -> dict:
+            return {key: value for key, value in assets.items() if key in fields}
+
+        listed = []
+        for item in items:
+            offer = dict(item["offers"][0])
+            state = self.offer_state(item, claims, False, False)
+            offer["offerSelfConnection"] = {"eligibility": state["eligibility"]}
+            if probe:
+                listed.append({"offers": [offer]})
+                continue
+
+            entry = {key: value for key, value in item.items() if key != "offers"}
+            entry["assets"] = selected(item["assets"])
+            entry["game"] = dict(item["game"], assets=selected(item["game"]["assets"]))
+            entry["offers"] = [offer]
+            listed.append(entry)
+        return listed
+
+    def offers_list(self, body: dict, claims: dict) -> dict:
+        # The probe asks for nothing but the offers, answer it just as small
+        probe = "assets" not in body.get("query", "")
+        fields = set(re.findall(r"\w+", body.get("query", "")))
+        variables = body.get("variables", {})
+
+        literal = LITERAL_COLLECTION.search(body.get("query", ""))
+        collection = variables.get("collectionType") or (literal.group(1) if literal else "LOOT")
+        items = self.collections[COLLECTION_TYPES.get(collection, "inGameLoot")]
+        size = int(variables.get("pageSize") or 999)
+        if "collectionType" not in variables:
+            # The single-page query from before cursors
+            return {"data": {"items": {"items": self.list_items(items[:size], claims, probe, fields)}}}
+
+        # One collection, one page; the cursor is just the offset of the next page
+        start = int(variables.get("after") or 0)
+        end = start + size
+        page_info = {"hasNextPage": end < len(items), "endCursor": str(end) if end < len(items) else None}
+        listed = self.list_items(items[start:end], claims, probe, fields)
+        return {"data": {"items": {"items": listed, "pageInfo": page_info}}}
+
+    def item_v2(self, body: dict, claims: dict) -> dict:
+        found = self.items.get(body.get("variables", {}).get("itemId"))
+        if found is None:
+            return {"data": {"itemV2": {"item": None, "error": {"code": "ITEM_NOT_FOUND"}}}}
+
+        item, link_required = found
+        offer = dict(item["offers"][0])
+        offer["offerSelfConnection"] = self.offer_state(item, claims, link_required, True)
+        return {"data": {"itemV2": {"item": dict(item, offers=[offer]), "error": None}}}
+
+    def place_orders(self, body: dict, claims: dict) -> dict:
+        offer_ids = body.get("variables", {}).get("input", {}).get("offerIds")
+        for offer_id in offer_ids if isinstance(offer_ids, list) else [offer_ids]:
+            claims.setdefault(offer_id, time.time())
+        return {"data": {"placeOrders": {"error": None}}}
+
+    def handle_operation(self, body: dict, token: str, aliased: bool = False) -> dict:
+        operation = body.get("operationName")
+        self.count(f"{operation}:aliased" if aliased else operation)
+
+        recorded = self.fixture(body)
+        if recorded is not None:
+            return recorded
+
+        if token is None:
+            return {"errors": [{"message": "Missing csrf-token"}]}
+        claims = self.account(token)
+
+        aliases = ALIASED_FIELD.findall(body.get("query", ""))
+        if aliases:
+            data = {}
+            for alias, field, argument, variable in aliases:
+                single = dict(body, query="", variables={argument: body.get("variables", {}).get(variable)})
+                data[alias] = self.handle_operation(single, token, aliased=True)["data"][field]
+            return {"data": data}
+
+        if operation == "Entry_Points_User":
+            user = {"isSignedIn": True, "isAmazonPrime": True, "isTwitchPrime": True, "firstName": "Mock"}
+            return {"data": {"currentUser": user}}
+        elif operation == "OffersContext_Offers_And_Items":
+            return self.offers_list(body, claims)
+        elif operation == "ItemV2Context":
+            return self.item_v2(body, claims)
+        elif operation == "placeOrdersDetailPage":
+            return self.place_orders(body, claims)
+        return {"errors": [{"message": f"Unknown operation {operation}"}]}
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes) -> tuple:
+        """Answer one HTTP request with (status, headers, body)."""
+        if path == "/mock/stats":
+            return 200, {"Content-Type": "application/json"}, json.dumps(self.requests).encode()
+        if method == "POST" and path == "/mock/reset":
+            self.reset()
+            return 204, {}, b""
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.count("error")
+            if self.random.random() < 0.5:
+                return 429, {"Retry-After": "0.1"}, b""
+            return 503, {}, b""
+
+        if method == "GET" and path == "/home":
+            self.count("home")
+            html = f"<html><body><input type='hidden' name='csrf-key' value='{self.new_token()}' /></body></html>"
+            return 200, {"Content-Type": "text/html"}, html.encode()
+
+        if method == "POST" and path == "/graphql":
+            try:
+                request = json.loads(body)
+            except ValueError:
+                return 400, {}, b"Invalid JSON"
+
+            if not self.paging and "pageInfo" in json.dumps(request):
+                # A schema without cursors fails validation like a GraphQL server does, before running anything
+                self.count("invalid")
+                error = {"message": 'Cannot query field "pageInfo" on type "ItemCollection".'}
+                error["extensions"] = {"code": "GRAPHQL_VALIDATION_FAILED"}
+                return 400, {"Content-Type": "application/json"}, json.dumps({"errors": [error]}).encode()
+
+            token = headers.get("csrf-token")
+            if isinstance(request, list):
+                response = [self.handle_operation(operation, token) for operation in request]
+            else:
+                response = self.handle_operation(request, token)
+            return 200, {"Content-Type": "application/json"}, json.dumps(response, separators=(",", ":")).encode()
+
+        return 404, {}, b"Not found"
+
+
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    429: "Too Many Requests",
+    503: "Service Unavailable",
+}
+
+
+async def serve(mock: MockPrimeGaming, host: str = "127.0.0.1", port: int = 0):
+    async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 with keep-alive, enough for httpx
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, response_headers, response_body = await mock.handle(method, path, headers, body)
+
+                head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(response_body)}"]
+                head.extend(f"{name}: {value}" for name, value in response_headers.items())
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + response_body)
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(connection, host, port)
+
+
+def load_fixtures(path: str) -> list:
+    """Recorded exchanges: a JSON list of {"operationName", "variables" (optional), "response"}."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def main(arg: dict):
+    mock = MockPrimeGaming(
+        loot=arg["loot"],
+        games=arg["games"],
+        publishers=arg["publishers"],
+        code_ratio=arg["code_ratio"],
+        link_ratio=arg["link_ratio"],
+        code_delay=arg["code_delay"],
+        latency=arg["latency"] / 1000,
+        jitter=arg["jitter"] / 1000,
+        error_rate=arg["error_rate"],
+        paging=arg["paging"],
+        fixtures=load_fixtures(arg["fixtures"]) if arg["fixtures"] else None,
+        seed=arg["seed"],
+    )
+    server = await serve(mock, arg["host"], arg["port"])
+    host, port = server.sockets[0].getsockname()[:2]
+    # The benchmark reads the address from this line
+    print(f"Listening on http://{host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the Prime Gaming GraphQL API")
+    parser.add_argument("--host", dest="host", default="127.0.0.1")
+    parser.add_argument("--port", dest="port", help="Port to listen on (default: any free port)", type=int, default=0)
+    parser.add_argument(
+        "--loot", dest="loot", help="Number of in-game loot offers (default 200)", type=int, default=200
+    )
+    parser.add_argument("--games", dest="games", help="Number of free game offers (default 20)", type=int, default=20)
+    parser.add_argument(
+        "--publishers", dest="publishers", help="Number of distinct publishers (default 10)", type=int, default=10
+    )
+    parser.add_argument(
+        "--code-ratio",
+        dest="code_ratio",
+        help="Share of offers that grant a code (default 0.3)",
+        type=float,
+        default=0.3,
+    )
+    parser.add_argument(
+        "--link-ratio",
+        dest="link_ratio",
+        help="Share of offers that need a linked account (default 0.05)",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--code-delay",
+        dest="code_delay",
+        help="Seconds after a claim until its code is available (default 2)",
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--latency", dest="latency", help="Milliseconds added to every response (default 0)", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--jitter", dest="jitter", help="Random extra milliseconds per response (default 0)", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--error-rate",
+        dest="error_rate",
+        help="Share of requests answered with HTTP 429 or 503 (default 0)",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--no-paging",
+        dest="paging",
+        help="Answer like the API before cursor paging: listings with pageInfo fail validation",
+        action="store_false",
+    )
+    parser.add_argument("--fixtures", dest="fixtures", help="JSON file of recorded responses to replay", default=None)
+    parser.add_argument("--seed", dest="seed", help="Random seed for the generated offers", type=int, default=0)
+
+    try:
+        asyncio.run(main(vars(parser.parse_args())))
+    except KeyboardInterrupt:
+        pass
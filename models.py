@@ -0,0 +1,127 @@
+from datetime import datetime
+
+
+def parse_time(value: str):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+class Eligibility:
+    __slots__ = ("is_claimed", "can_claim", "missing_account_link", "offer_state")
+
+    def __init__(self, is_claimed=False, can_claim=False, missing_account_link=False, offer_state=None):
+        self.is_claimed = is_claimed
+        self.can_claim = can_claim
+        self.missing_account_link = missing_account_link
+        self.offer_state = offer_state
+
+    @classmethod
+    def parse(cls, data: dict):
+        if not data:
+            return None
+        return cls(
+            bool(data.get("isClaimed")),
+            bool(data.get("canClaim")),
+            bool(data.get("missingRequiredAccountLink")),
+            data.get("offerState"),
+        )
+
+
+class Offer:
+    __slots__ = ("id", "start_time", "end_time", "eligibility", "claim_code")
+
+    def __init__(self, id, start_time=None, end_time=None, eligibility=None, claim_code=None):
+        self.id = id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.eligibility = eligibility
+        self.claim_code = claim_code
+
+    @classmethod
+    def parse(cls, data: dict):
+        connection = data.get("offerSelfConnection") or {}
+        order_information = connection.get("orderInformation") or [{}]
+        return cls(
+            data["id"],
+            data.get("startTime"),
+            data.get("endTime"),
+            Eligibility.parse(connection.get("eligibility")),
+            order_information[0].get("claimCode"),
+        )
+
+    def update(self, data: dict):
+        # Apply the per-account state from an eligibility or code response to this offer
+        connection = data.get("offerSelfConnection") or {}
+        if "eligibility" in connection:
+            self.eligibility = Eligibility.parse(connection["eligibility"])
+        if connection.get("orderInformation"):
+            self.claim_code = connection["orderInformation"][0].get("claimCode")
+
+
+class Item:
+    """The parts of a Prime Gaming item the looter acts on, flattened out of the GraphQL response."""
+
+    __slots__ = (
+        "id",
+        "asset_id",
+        "title",
+        "claim_link",
+        "claim_instructions",
+        "grants_code",
+        "priority",
+        "game_id",
+        "game_title",
+        "publisher",
+        "offer",
+    )
+
+    # Account-independent fields, the ones the offer cache keeps
+    static_fields = __slots__[:-1]
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def parse(cls, data: dict):
+        assets = data.get("assets") or {}
+        game = data.get("game") or {}
+        game_assets = game.get("assets") or {}
+        offers = data.get("offers") or []
+        return cls(
+            id=data.get("id"),
+            asset_id=assets.get("id"),
+            title=assets.get("title"),
+            claim_link=assets.get("externalClaimLink"),
+            claim_instructions=assets.get("claimInstructions"),
+            grants_code=bool(data.get("grantsCode")),
+            priority=data.get("priority"),
+            game_id=game.get("id"),
+            game_title=game_assets.get("title"),
+            publisher=game_assets.get("publisher"),
+            offer=Offer.parse(offers[0]) if offers else None,
+        )
+
+    @property
+    def name(self) -> str:
+        return f"{self.game_title} - {self.title}"
+
+    def update(self, data: dict):
+        offers = data.get("offers") or []
+        if self.offer is not None and offers:
+            self.offer.update(offers[0])
+
+    def to_static(self) -> dict:
+        static = {name: getattr(self, name) for name in self.static_fields}
+        static["offer"] = {"id": self.offer.id, "start_time": self.offer.start_time, "end_time": self.offer.end_time}
+        return static
+
+    @classmethod
+    def from_static(cls, static: dict):
+        item = cls(**{name: static.get(name) for name in cls.static_fields})
+        item.offer = Offer(**static["offer"])
+        return item
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import time
+from models import Item, parse_time
+
+log = logging.getLogger()
+
+# Offers without an endTime are kept this long before being fetched again
+DEFAULT_TTL = 60 * 60 * 24 * 7
+
+
+def offer_expiry(item: Item) -> float:
+    end_time = parse_time(item.offer.end_time) if item.offer else None
+    return end_time if end_time is not None else time.time() + DEFAULT_TTL
+
+
+class OfferCache:
+    """Static ItemV2Context documents keyed by item id and offer id, kept on disk until the offer ends."""
+
+    def __init__(self, path: str, version: str):
+        self.path = path
+        self.version = version
+        self.entries = {}
+        self.dirty = False
+
+    @staticmethod
+    def key(item: Item) -> str:
+        return f"{item.asset_id}:{item.offer.id}"
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Offer cache: Unable to read %s, starting empty (%s)", self.path, e)
+            return
+
+        # A different query shape means the stored documents may be missing fields; start over
+        if stored.get("version") != self.version:
+            self.dirty = True
+            return
+
+        now = time.time()
+        self.entries = {key: entry for key, entry in stored.get("entries", {}).items() if entry["expires"] > now}
+        self.dirty = len(self.entries) != len(stored.get("entries", {}))
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def get(self, item: Item):
+        entry = self.entries.get(self.key(item))
+        if entry is None:
+            return None
+
+        if entry["expires"] <= time.time():
+            self.invalidate(item)
+            return None
+
+        return Item.from_static(entry["item"])
+
+    def put(self, item: Item):
+        self.entries[self.key(item)] = {"expires": offer_expiry(item), "item": item.to_static()}
+        self.dirty = True
+
+    def invalidate(self, item: Item):
+        if self.entries.pop(self.key(item), None) is not None:
+            self.dirty = True
+
+    def clear(self):
+        self.entries = {}
+        self.dirty = True
@@ -1,71 +1,135 @@
 import argparse
+import cProfile
 import logging
 import sys
 import asyncio
+import random
 import time
 import traceback
-from api import primelooter, AuthException
-from logging import LogRecord
+from api import primelooter, close_sessions, find_cookie_files, tag_account, AuthException, RunSummary
+from metrics import serve_prometheus
+from filter_rules import FilterRules
+from control import Daemon, serve_control
+from log_setup import setup_logging
 
-def build_handler_filters(handler: str):
-    def handler_filter(record: LogRecord):
-        if hasattr(record, "block"):
-            if record.block == handler:
-                return False
-        return True
+log = logging.getLogger()
 
-    return handler_filter
 
+def plan_next_run(summary: RunSummary, arg) -> float:
+    now = time.time()
+    wakeups = [now + arg["max_interval"] * 60]
 
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.addFilter(build_handler_filters("console"))
-file_handler = logging.FileHandler("primelooter.log")
-file_handler.addFilter(build_handler_filters("file"))
+    # Be back shortly after the next announced drop goes live
+    if summary.next_start is not None:
+        wakeups.append(summary.next_start + 60)
 
-logging.basicConfig(
-    level=logging.INFO,
-    # format="%(asctime)s [%(levelname)s] %(msg)s",
-    format="{asctime} [{levelname}] {message}",
-    style="{",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[file_handler, stream_handler],
-)
+    # Offers that failed or didn't fit into the time budget are retried as soon as allowed
+    if summary.failed or summary.deferred:
+        wakeups.append(now)
 
-log = logging.getLogger()
+    # Give offers we couldn't claim one more try before they expire
+    pre_expiry = arg["pre_expiry"] * 60
+    wakeups.extend(end - pre_expiry for end in summary.unclaimed_ends if end - pre_expiry > now)
+
+    wake = max(min(wakeups), now + arg["min_interval"] * 60)
+    return wake + random.uniform(0, arg["jitter"] * 60)
+
+
+async def sleep_until(wake: float, countdown: bool = False):
+    log.info("Loop Enabled, next run at %s.", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(wake)))
+    if not countdown:
+        await asyncio.sleep(max(0.0, wake - time.time()))
+        return
+
+    # Redrawn in place on the terminal, never a log record
+    while (remaining := wake - time.time()) > 0:
+        m, s = divmod(int(remaining), 60)
+        h, m = divmod(m, 60)
+        sys.stdout.write(f"\r{h:d}:{m:02d}:{s:02d} till next run...")
+        sys.stdout.flush()
+        await asyncio.sleep(min(1, remaining))
+    sys.stdout.write("\r\033[K")
+    sys.stdout.flush()
+
+
+async def use_api(cookie_files, publishers, arg):
+    metrics_server = None
+    if arg["metrics_port"]:
+        metrics_server = await serve_prometheus(arg["metrics_port"])
+
+    try:
+        if arg["daemon"]:
+            await run_daemon(cookie_files, publishers, arg)
+        else:
+            await loot_loop(cookie_files, publishers, arg)
+    finally:
+        await close_sessions()
+        if metrics_server is not None:
+            metrics_server.close()
+
+
+async def run_daemon(cookie_files, publishers, arg):
+    async def run(selected_cookie_files):
+        return await loot_once(selected_cookie_files, publishers, arg)
+
+    plan = (lambda summary: plan_next_run(summary, arg)) if arg["loop"] else None
+    daemon = Daemon(cookie_files, run, plan)
+    control_server = await serve_control(daemon, arg["control_port"], arg["control_socket"])
+    try:
+        await daemon.loop()
+    finally:
+        control_server.close()
+
+
+async def loot_once(cookie_files, publishers, arg) -> RunSummary:
+    log.info("Starting Prime Looter\n")
+    summary = await primelooter(
+        cookie_files,
+        publishers,
+        concurrency=arg["concurrency"],
+        max_requests=arg["max_requests"],
+        cache_file=None if arg["no_cache"] else arg["cache_file"],
+        ledger_file=arg["ledger"],
+        incremental=arg["incremental"],
+        probe=not arg["no_probe"],
+        session_dir=arg["session_dir"],
+        code_file=arg["codes"],
+        metrics_file=arg["metrics_file"],
+        batch_size=arg["batch_size"],
+        batch_interval=arg["batch_interval"] / 1000,
+        time_budget=arg["time_budget"],
+        pre_expiry=arg["pre_expiry"] * 60,
+        http2=not arg["no_http2"],
+        adaptive=not arg["fixed_requests"],
+        max_connections=arg["max_connections"],
+        max_keepalive=arg["max_connections"],
+        retries=arg["retries"],
+        backoff=arg["retry_backoff"],
+    )
+    log.info("Finished Looting!\n")
+    return summary
 
-async def use_api(cookie_file, publishers, arg):
+
+async def loot_loop(cookie_files, publishers, arg):
     while True:
         try:
-            log.info("Starting Prime Looter\n")
-            await primelooter(cookie_file, publishers)
-            log.info("Finished Looting!\n")
+            summary = await loot_once(cookie_files, publishers, arg)
         except AuthException as ex:
             log.error(ex)
             sys.exit(1)
         except Exception as ex:
             log.error(ex)
             traceback.print_tb(ex.__traceback__)
-            time.sleep(60)
+            await asyncio.sleep(60)
         else:
             if arg["loop"]:
-                log.info("Loop Enabled, sleeping for 24 hours.")
-                stream_handler.terminator = "\r"
-
-                sleep_time = 60 * 60 * 24
-                for time_slept in range(sleep_time):
-                    m, s = divmod(sleep_time - time_slept, 60)
-                    h, m = divmod(m, 60)
-                    log.info(
-                        f"{h:d}:{m:02d}:{s:02d} till next run...",
-                        extra={"block": "file"},
-                    )
-                    time.sleep(1)
-
-                stream_handler.terminator = "\n"
+                countdown = sys.stdout.isatty() and arg["log_format"] == "text"
+                await sleep_until(plan_next_run(summary, arg), countdown)
 
         if not arg["loop"]:
             break
 
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Notification bot for the lower saxony vaccination portal")
 
@@ -81,19 +145,241 @@ if __name__ == "__main__":
         "-c",
         "--cookies",
         dest="cookies",
-        help="Path to cookies.txt file",
+        help="Path to cookies.txt file(s) or a directory of them, one per account (the file name is the account name)",
         required=False,
-        default="cookies.txt",
+        nargs="+",
+        default=["cookies.txt"],
     )
     parser.add_argument(
         "-l",
         "--loop",
         dest="loop",
-        help="Shall the script loop itself? (Cooldown 24h)",
+        help="Shall the script loop itself? (Next run is planned from offer start/end times, at most 24h apart)",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--min-interval",
+        dest="min_interval",
+        help="Minimum minutes between two looped runs",
+        required=False,
+        type=float,
+        default=30,
+    )
+    parser.add_argument(
+        "--max-interval",
+        dest="max_interval",
+        help="Maximum minutes between two looped runs",
+        required=False,
+        type=float,
+        default=60 * 24,
+    )
+    parser.add_argument(
+        "--jitter",
+        dest="jitter",
+        help="Random minutes added to each planned run",
+        required=False,
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        "--pre-expiry",
+        dest="pre_expiry",
+        help="Minutes before an unclaimed offer expires to try it one last time",
+        required=False,
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "-j",
+        "--concurrency",
+        dest="concurrency",
+        help="How many offers to fetch and claim in parallel",
+        required=False,
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--max-requests",
+        dest="max_requests",
+        help="Requests in flight at once across all accounts to start with, adapted up to 4x from there (default 16)",
+        required=False,
+        type=int,
+        default=16,
+    )
+    parser.add_argument(
+        "--fixed-requests",
+        dest="fixed_requests",
+        help="Keep --max-requests fixed instead of adapting it to latency, throttling and errors",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--max-connections",
+        dest="max_connections",
+        help="Connection pool size per account",
+        required=False,
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "--no-http2",
+        dest="no_http2",
+        help="Talk HTTP/1.1 only",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--retries",
+        dest="retries",
+        help="How often to retry a request after a connection error, HTTP 429 or 5xx",
+        required=False,
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        dest="retry_backoff",
+        help="Seconds to wait before the first retry, doubled for each further one (Retry-After wins)",
+        required=False,
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        help="How many pending offer lookups or claims are sent in one request (default: -j, 1 turns batching off)",
+        required=False,
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--batch-interval",
+        dest="batch_interval",
+        help="Milliseconds to wait for more lookups or claims before sending a batch that isn't full (default 20)",
+        required=False,
+        type=float,
+        default=20,
+    )
+    parser.add_argument(
+        "--time-budget",
+        dest="time_budget",
+        help="Seconds a run may start new claims for, the rest is left for the next run (default: no limit)",
+        required=False,
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--codes",
+        dest="codes",
+        help="Path to the database retrieved game codes are stored in",
+        required=False,
+        default="game_codes.db",
+    )
+    parser.add_argument(
+        "--session-dir",
+        dest="session_dir",
+        help="Where refreshed cookies and CSRF tokens are kept between runs",
+        required=False,
+        default=".sessions",
+    )
+    parser.add_argument(
+        "--cache-file",
+        dest="cache_file",
+        help="Path to the offer details cache",
+        required=False,
+        default="offer_cache.json",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        help="Always download full offer details",
         required=False,
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--ledger",
+        dest="ledger",
+        help="Path to the claim ledger database, which also holds the checkpoint an interrupted run resumes from",
+        required=False,
+        default="primelooter.db",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        dest="incremental",
+        help="Skip offers the ledger has already settled (claimed or excluded by publisher)",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--no-probe",
+        dest="no_probe",
+        help="Always do a full run, even if no offer changed since the last one",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--daemon",
+        dest="daemon",
+        help="Keep running and accept runs through a local control API (scheduled runs too with --loop)",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--control-port",
+        dest="control_port",
+        help="Port of the daemon control API on 127.0.0.1 (default 8770)",
+        required=False,
+        type=int,
+        default=8770,
+    )
+    parser.add_argument(
+        "--control-socket",
+        dest="control_socket",
+        help="Serve the daemon control API on this Unix socket instead of a port",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        help="Write timings, byte counts, retries and outcomes of each run to this JSON file",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        dest="metrics_port",
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+        required=False,
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        help="Write a cProfile dump of the whole run to this file",
+        required=False,
+        nargs="?",
+        const="primelooter.prof",
+        default=None,
+    )
+    parser.add_argument(
+        "--log-format",
+        dest="log_format",
+        help="Write the log as plain text lines or as one JSON object per line (default text)",
+        required=False,
+        choices=["text", "json"],
+        default="text",
+    )
     parser.add_argument(
         "-d",
         "--debug",
@@ -105,12 +391,36 @@ if __name__ == "__main__":
     )
 
     arg = vars(parser.parse_args())
+    level = logging.DEBUG if arg["debug"] else logging.INFO
+    listener = setup_logging(arg["log_format"], level=level, filters=[tag_account])
 
-    with open(arg["publishers"]) as f:
-        publishers = f.readlines()
-    publishers = [x.strip() for x in publishers]
-    cookie_file = arg["cookies"]
-    if arg["debug"]:
-        log.level = logging.DEBUG
-    
-    asyncio.run(use_api(cookie_file, publishers, arg))
+    try:
+        with open(arg["publishers"]) as f:
+            publishers = f.readlines()
+        publishers = [x.strip() for x in publishers]
+        try:
+            FilterRules(publishers)
+        except ValueError as e:
+            log.error("%s: %s", arg["publishers"], e)
+            sys.exit(1)
+        cookie_files = arg["cookies"]
+        try:
+            find_cookie_files(cookie_files)
+        except ValueError as e:
+            log.error("%s", e)
+            sys.exit(1)
+
+        if arg["profile"]:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                asyncio.run(use_api(cookie_files, publishers, arg))
+            finally:
+                profiler.disable()
+                profiler.dump_stats(arg["profile"])
+                log.info("Profile written to %s", arg["profile"])
+        else:
+            asyncio.run(use_api(cookie_files, publishers, arg))
+    finally:
+        # Flush whatever is still queued before the process goes away
+        listener.stop()
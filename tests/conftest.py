@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import api
+from mock_server import MockPrimeGaming
+
+
+@pytest.fixture
+def mock(monkeypatch, tmp_path):
+    """The mock API served in-process: every client the looter creates talks to it through httpx.MockTransport."""
+    server = MockPrimeGaming(loot=20, games=4, publishers=3, code_ratio=0.4, link_ratio=0.0, code_delay=0.0, seed=1)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        status, headers, body = await server.handle(
+            request.method, request.url.path, dict(request.headers), request.content
+        )
+        return httpx.Response(status, headers=headers, content=body)
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(api, "create_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    # primelooter() writes its settings into these module globals, keep them from leaking into other tests
+    monkeypatch.setattr(api, "transport", dict(api.transport, http2=False, backoff=0.01))
+    monkeypatch.setattr(api, "batching", dict(api.batching))
+    monkeypatch.setattr(api, "code_polling", {"first_delay": 0.01, "max_delay": 0.02, "timeout": 0.3})
+    monkeypatch.setattr(api, "game_publishers", {})
+    monkeypatch.setattr(api, "cursor_paging", True)
+    monkeypatch.setattr(api, "pre_expiry_window", api.pre_expiry_window)
+    return server
+
+
+@pytest.fixture
+def run_looter(mock, tmp_path):
+    """Run primelooter() for one account against the mock and return its RunSummary."""
+    cookie_file = tmp_path / "account.txt"
+    cookie_file.write_text(
+        "# Netscape HTTP Cookie File\n" f"127.0.0.1\tFALSE\t/\tFALSE\t{int(time.time()) + 86400}\tsession-id\tmock\n",
+        encoding="utf-8",
+    )
+
+    def run(publishers=("all",), **options):
+        async def main():
+            try:
+                return await api.primelooter(
+                    str(cookie_file),
+                    list(publishers),
+                    cache_file=str(tmp_path / "offer_cache.json"),
+                    ledger_file=str(tmp_path / "primelooter.db"),
+                    session_dir=str(tmp_path / "sessions"),
+                    code_file=str(tmp_path / "game_codes.db"),
+                    **options,
+                )
+            finally:
+                await api.close_sessions()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,20 @@
+import pytest
+
+from api import find_cookie_files
+
+
+def test_accounts_with_the_same_file_name_are_rejected(tmp_path):
+    for directory in ("a", "b"):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "cookies.txt").write_text("")
+
+    with pytest.raises(ValueError, match="'cookies'"):
+        find_cookie_files([str(tmp_path / "a" / "cookies.txt"), str(tmp_path / "b" / "cookies.txt")])
+
+
+def test_the_same_cookie_file_twice_is_one_account(tmp_path):
+    (tmp_path / "one.txt").write_text("")
+    (tmp_path / "two.txt").write_text("")
+
+    found = find_cookie_files([str(tmp_path), str(tmp_path / "one.txt")])
+    assert found == [str(tmp_path / "one.txt"), str(tmp_path / "two.txt")]
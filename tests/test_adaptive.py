@@ -0,0 +1,102 @@
+import asyncio
+import math
+
+import pytest
+
+import adaptive
+from adaptive import AdaptiveLimit
+
+
+def test_successes_grow_the_limit_up_to_the_maximum():
+    limit = AdaptiveLimit("test", 4, maximum=6)
+
+    # One limit's worth of successful requests adds about one
+    for _ in range(4):
+        limit.succeeded(0.1, "list")
+    assert 4.9 < limit.limit < 5
+
+    for _ in range(100):
+        limit.succeeded(0.1, "list")
+    assert limit.limit == 6
+
+
+def test_throttling_halves_the_limit_once_per_cooldown():
+    limit = AdaptiveLimit("test", 16)
+
+    limit.throttled("HTTP 429")
+    limit.throttled("HTTP 429")
+    assert limit.limit == 8
+    assert limit.backoffs == 1
+
+    limit.last_decrease = -math.inf
+    for _ in range(10):
+        limit.throttled("HTTP 503")
+        limit.last_decrease = -math.inf
+    assert limit.limit == 1
+    assert limit.backoffs == 11
+
+
+def test_slow_responses_shrink_the_limit_a_little():
+    limit = AdaptiveLimit("test", 10, maximum=20)
+    limit.succeeded(0.1, "claim")
+
+    # Slower than the baseline, but not enough to count
+    limit.succeeded(0.25, "claim")
+    assert limit.limit > 10
+
+    previous = limit.limit
+    limit.succeeded(0.5, "claim")
+    assert limit.limit == pytest.approx(previous * adaptive.LATENCY_DECREASE)
+
+    # Every operation has its own baseline, a slow one isn't throttled by a fast one
+    previous = limit.limit
+    limit.last_decrease = -math.inf
+    limit.succeeded(0.5, "list")
+    assert limit.limit > previous
+
+
+def test_a_fixed_limit_does_not_adapt():
+    limit = AdaptiveLimit("test", 4, maximum=16, adaptive=False)
+
+    limit.succeeded(0.1, "list")
+    limit.succeeded(5.0, "list")
+    limit.throttled("HTTP 429")
+    assert limit.limit == 4
+    assert limit.backoffs == 0
+
+
+def test_requests_wait_for_a_free_slot():
+    async def main():
+        limit = AdaptiveLimit("test", 2, adaptive=False)
+        running, peak = 0, 0
+
+        async def request():
+            nonlocal running, peak
+            async with limit:
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(request() for _ in range(6)))
+        return peak, limit.status()
+
+    peak, status = asyncio.run(main())
+    assert peak == 2
+    assert status == {"limit": 2, "in_flight": 0, "waiting": 0, "backoffs": 0}
+
+
+def test_a_cancelled_waiter_gives_its_turn_to_the_next():
+    async def main():
+        limit = AdaptiveLimit("test", 1, adaptive=False)
+        await limit.acquire()
+        first = asyncio.ensure_future(limit.acquire())
+        second = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+
+        first.cancel()
+        limit.release()
+        await second
+        return first.cancelled(), limit.in_flight, len(limit.waiters)
+
+    assert asyncio.run(main()) == (True, 1, 0)
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import api
+from api import Batcher, BodyTemplate
+
+item_body = BodyTemplate(
+    "Item",
+    "query Item($itemId: String, $debug: Boolean) { itemV2(itemId: $itemId, debug: $debug) { id } }",
+    {"itemId": ..., "debug": False},
+)
+
+
+def test_a_batch_aliases_the_field_and_numbers_the_variables():
+    template = item_body.batch(2)
+
+    assert template is item_body.batch(2)
+    assert template.label == "Item:batch"
+    assert template.names == ["itemId0", "itemId1"]
+    assert json.loads(template.render(itemId0="a", itemId1='b"')) == {
+        "operationName": "Item",
+        "variables": {"itemId0": "a", "debug0": False, "itemId1": 'b"', "debug1": False},
+        "extensions": {},
+        "query": "query Item($itemId0: String, $debug0: Boolean, $itemId1: String, $debug1: Boolean) {"
+        "b0: itemV2(itemId: $itemId0, debug: $debug0) { id } b1: itemV2(itemId: $itemId1, debug: $debug1) { id } }",
+    }
+
+
+def call_all(handler, values: list, size: int = 10):
+    """Make one call per value through a Batcher at once; returns the results (or exceptions) and the Batcher."""
+
+    async def main():
+        api.batching.update(size=size, interval=0.01)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            batcher = Batcher(client, {}, item_body)
+            results = await asyncio.gather(*(batcher.call(value) for value in values), return_exceptions=True)
+            return results, batcher
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(api, "batching", dict(api.batching))
+    monkeypatch.setattr(api, "transport", dict(api.transport, backoff=0.01))
+
+
+def test_every_caller_gets_its_own_alias_and_a_missing_one_only_fails_its_caller():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        variables = json.loads(request.content)["variables"]
+        requests.append(variables)
+        data = {f"b{i}": {"id": variables[f"itemId{i}"]} for i in range(3) if variables[f"itemId{i}"] != "gone"}
+        return httpx.Response(200, json={"data": data, "errors": [{"message": "gone not found"}]})
+
+    results, _ = call_all(handler, ["a", "gone", "c"])
+
+    assert len(requests) == 1
+    assert results[0] == {"id": "a"} and results[2] == {"id": "c"}
+    assert isinstance(results[1], LookupError)
+
+
+def test_a_rejected_batch_is_sent_one_by_one_from_then_on():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body["variables"])
+        if "b0:" in body["query"]:
+            return httpx.Response(400, json={"errors": [{"message": "Only one mutation field is allowed"}]})
+        return httpx.Response(200, json={"data": {"itemV2": {"id": body["variables"]["itemId"]}}})
+
+    results, batcher = call_all(handler, ["a", "b", "c"])
+
+    assert results == [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    assert not batcher.aliasing
+    assert len(requests) == 4
+
+
+def test_a_batch_that_fails_one_by_one_too_keeps_aliasing():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"data": None, "errors": [{"message": "Unauthorized"}]})
+
+    results, batcher = call_all(handler, ["a", "b"])
+
+    assert all(isinstance(result, LookupError) for result in results)
+    assert batcher.aliasing
+
+
+def test_claims_go_through_when_aliased_mutations_are_rejected(mock, run_looter, monkeypatch):
+    handle = mock.handle
+
+    async def no_aliased_mutations(method, path, headers, body):
+        if b"placeOrders" in body and b"b0:" in body:
+            return 400, {"Content-Type": "application/json"}, b'{"errors": [{"message": "One mutation at a time"}]}'
+        return await handle(method, path, headers, body)
+
+    monkeypatch.setattr(mock, "handle", no_aliased_mutations)
+    summary = run_looter()
+    assert not summary.failed
+    (claims,) = mock.accounts.values()
+    assert len(claims) == len(mock.items)
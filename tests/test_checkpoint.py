@@ -0,0 +1,60 @@
+import pytest
+
+from code_store import CodeStore
+from ledger import Ledger, CODE_PENDING
+
+
+def code_offers(mock) -> int:
+    return sum(item["grantsCode"] for items in mock.collections.values() for item in items)
+
+
+def test_codes_that_timed_out_are_fetched_on_the_next_run(mock, run_looter, tmp_path):
+    mock.code_delay = 3600
+    run_looter()
+
+    ledger = Ledger(str(tmp_path / "primelooter.db"))
+    pending = [step for step in ledger.checkpoint("account").values() if step == CODE_PENDING]
+    ledger.close()
+    assert len(pending) == code_offers(mock)
+
+    mock.code_delay = 0
+    run_looter()
+    assert CodeStore(str(tmp_path / "game_codes.db")).count() == code_offers(mock)
+
+
+def test_codes_that_timed_out_are_fetched_on_an_incremental_run(mock, run_looter, tmp_path):
+    mock.code_delay = 3600
+    run_looter(incremental=True)
+
+    mock.code_delay = 0
+    run_looter(incremental=True)
+    assert CodeStore(str(tmp_path / "game_codes.db")).count() == code_offers(mock)
+
+    ledger = Ledger(str(tmp_path / "primelooter.db"))
+    assert ledger.checkpoint("account") == {}
+    ledger.close()
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_resumed_codes_are_saved_with_their_instructions(mock, run_looter, tmp_path, cached):
+    mock.code_delay = 3600
+    run_looter()
+    if not cached:
+        (tmp_path / "offer_cache.json").unlink()
+
+    # The list query doesn't ask for the instructions, they come from the cache or the details
+    mock.code_delay = 0
+    run_looter()
+    rows = CodeStore(str(tmp_path / "game_codes.db")).search()
+    assert len(rows) == code_offers(mock)
+    assert all(row["instructions"].startswith("Redeem the code") for row in rows)
+
+
+def test_failed_offers_dont_fail_the_account_or_keep_the_checkpoint(mock, run_looter, tmp_path, monkeypatch):
+    monkeypatch.setattr(mock, "place_orders", lambda body, claims: {"data": {"placeOrders": {"error": {"code": "X"}}}})
+    summary = run_looter()
+    assert summary.failed == sum(len(items) for items in mock.collections.values())
+
+    ledger = Ledger(str(tmp_path / "primelooter.db"))
+    assert ledger.checkpoint("account") == {}
+    ledger.close()
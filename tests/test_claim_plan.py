@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+import api
+from api import ClaimPlan
+from mock_server import format_time
+from models import Item, Offer
+
+HOUR = 60 * 60
+
+
+def item(name: str, ends_in: float = None, grants_code: bool = False, priority: int = None) -> Item:
+    end_time = format_time(time.time() + ends_in) if ends_in is not None else None
+    offer = Offer(f"{name}-offer", end_time=end_time)
+    return Item(title=name, grants_code=grants_code, priority=priority, offer=offer)
+
+
+def handed_out(items: list, deadline: float = None) -> tuple:
+    async def main():
+        plan = ClaimPlan()
+        for entry in items:
+            plan.add(entry)
+        plan.close(1)
+        order = []
+        while (entry := await plan.next()) is not None:
+            order.append(entry.title)
+        return order, [entry.title for entry in plan.deferred]
+
+    api.run_deadline = deadline
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def no_deadline(monkeypatch):
+    monkeypatch.setattr(api, "run_deadline", None)
+
+
+def test_urgent_offers_first_then_codes_then_expiry_and_priority():
+    order, deferred = handed_out(
+        [
+            item("later", 10 * 24 * HOUR, priority=1),
+            item("sooner", 5 * 24 * HOUR, priority=9),
+            item("code", 20 * 24 * HOUR, grants_code=True),
+            item("urgent", 2 * HOUR),
+            item("urgent code", 12 * HOUR, grants_code=True),
+            item("no end", priority=0),
+            item("urgent sooner", HOUR),
+        ]
+    )
+
+    assert order == ["urgent sooner", "urgent", "urgent code", "code", "sooner", "later", "no end"]
+    assert deferred == []
+
+
+def test_equal_expiry_goes_by_priority_then_listing_order():
+    order, _ = handed_out(
+        [
+            item("second", priority=2),
+            item("first", priority=1),
+            item("unranked a"),
+            item("unranked b"),
+        ]
+    )
+
+    assert order == ["first", "second", "unranked a", "unranked b"]
+
+
+def test_nothing_is_handed_out_after_the_deadline():
+    order, deferred = handed_out([item("a", HOUR), item("b", 2 * HOUR)], deadline=time.monotonic() - 1)
+
+    assert order == []
+    assert deferred == ["a", "b"]
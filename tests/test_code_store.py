@@ -0,0 +1,62 @@
+import pytest
+
+from code_store import LEGACY_SEPARATOR, CodeStore
+from models import Item, Offer
+
+LEGACY = (
+    f"Mock Game 1 - Mock Loot 1 Code: MOCK-1\n\nRedeem it in the shop.\nThen restart the game.\n{LEGACY_SEPARATOR}"
+    f"Mock Game 2 - Mock Loot 2 Code: MOCK-2\n\nRedeem it on the website.\n{LEGACY_SEPARATOR}"
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CodeStore(str(tmp_path / "game_codes.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def legacy_file(tmp_path):
+    path = tmp_path / "game_codes.txt"
+    path.write_text(LEGACY, encoding="utf-8")
+    return str(path)
+
+
+def test_importing_a_legacy_file_twice_adds_nothing_the_second_time(store, legacy_file):
+    assert store.import_legacy(legacy_file) == 2
+    assert store.import_legacy(legacy_file) == 0
+
+    rows = store.search()
+    assert [(row["name"], row["code"]) for row in rows] == [
+        ("Mock Game 1 - Mock Loot 1", "MOCK-1"),
+        ("Mock Game 2 - Mock Loot 2", "MOCK-2"),
+    ]
+    assert rows[0]["instructions"] == "Redeem it in the shop.\nThen restart the game."
+    assert all(row["offer_id"].startswith("legacy:") for row in rows)
+
+
+def test_a_stored_code_replaces_its_legacy_row(store, legacy_file):
+    store.import_legacy(legacy_file)
+
+    offer = Offer("loot-offer-1", claim_code="MOCK-1")
+    item = Item(id="item-1", title="Mock Loot 1", game_title="Mock Game 1", claim_instructions="New", offer=offer)
+    store.add("account", item)
+    store.flush()
+
+    rows = {row["code"]: row for row in store.search()}
+    assert store.count() == 2
+    assert rows["MOCK-1"]["offer_id"] == "loot-offer-1"
+    assert rows["MOCK-1"]["instructions"] == "New"
+    assert rows["MOCK-2"]["offer_id"].startswith("legacy:")
+
+    # Nor does the legacy row come back with another import
+    assert store.import_legacy(legacy_file) == 0
+    assert store.count() == 2
+
+
+def test_the_automatic_import_runs_once(store, legacy_file, tmp_path):
+    assert store.import_legacy_once(str(tmp_path / "missing.txt")) == 0
+    assert store.import_legacy_once(legacy_file) == 2
+    store.db.execute("DELETE FROM codes")
+    assert store.import_legacy_once(legacy_file) == 0
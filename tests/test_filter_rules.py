@@ -0,0 +1,45 @@
+import pytest
+
+from filter_rules import FilterRules
+
+
+def test_deny_rules_win_over_all():
+    rules = FilterRules(["all", "!Mock Publisher 1", "!re:^Evil"])
+
+    assert rules.publisher_allowed("Mock Publisher 0")
+    assert not rules.publisher_allowed("Mock Publisher 1")
+    assert not rules.publisher_allowed("Evil Games")
+    assert not rules.publisher_allowed(None)
+
+
+def test_deny_rules_win_over_names_and_patterns():
+    rules = FilterRules(["Mock Publisher 1", "re:Mock", "!re:1$"])
+
+    assert rules.publisher_allowed("Mock Publisher 2")
+    assert not rules.publisher_allowed("Mock Publisher 1")
+    assert not rules.publisher_allowed("Other Publisher")
+
+
+def test_comments_and_blank_lines_are_ignored():
+    rules = FilterRules(["# all", "", "  Mock Publisher 1  "])
+
+    assert rules.lines == ["Mock Publisher 1"]
+    assert rules.publisher_allowed("Mock Publisher 1")
+    assert not rules.publisher_allowed("Mock Publisher 2")
+
+
+def test_title_rules_exclude_by_title_or_game_title():
+    rules = FilterRules(["all", "!title: Mock Loot 3", "!title:re:(?i)teaser"], title_blacklist=["Prime Day"])
+
+    assert rules.title_excluded("Mock Loot 3", "Mock Game 0")
+    assert rules.title_excluded("Mock Loot 4", "Season Teasers")
+    assert rules.title_excluded("Prime Day", None)
+    assert not rules.title_excluded("Mock Loot 4", "Mock Game 0")
+    # Title rules don't touch publishers
+    assert rules.publisher_allowed("Mock Loot 3")
+
+
+@pytest.mark.parametrize("line", ["title:Mock Loot 3", "re:(unclosed"])
+def test_invalid_rules_are_rejected(line):
+    with pytest.raises(ValueError):
+        FilterRules([line])
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from json_stream import ANY, JsonStream
+
+ITEM = ("data", "items", "items", ANY)
+INFO = ("data", "items", "pageInfo")
+ERRORS = ("errors",)
+
+DOCUMENT = {
+    "data": {
+        "items": {
+            "items": [
+                {"id": "1", "title": 'Quote " and backslash \\ in a string', "tags": ["{", "[", "]"]},
+                {"id": "2", "title": "Ünïcödé ✓ and \\u escapes é", "nested": {"items": [{"id": "x"}]}},
+                {"id": "3", "title": 'key-like "a": string', "empty": {}, "list": []},
+            ],
+            "pageInfo": {"hasNextPage": True, "endCursor": "3"},
+        }
+    },
+    "errors": [{"message": "Partial result"}],
+}
+
+
+def parse(data: bytes, size: int) -> list:
+    stream = JsonStream((ITEM, INFO, ERRORS))
+    found = []
+    # Multi-byte characters get cut in the middle too
+    for chunk in (data[start:][:size] for start in range(0, len(data), size)):
+        found.extend(stream.feed(chunk))
+    stream.close()
+    return found
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 100000])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_values_are_the_same_for_any_chunk_boundaries(size, indent):
+    data = json.dumps(DOCUMENT, indent=indent, ensure_ascii=False).encode()
+
+    assert parse(data, size) == [
+        *((ITEM, item) for item in DOCUMENT["data"]["items"]["items"]),
+        (INFO, DOCUMENT["data"]["items"]["pageInfo"]),
+        (ERRORS, DOCUMENT["errors"]),
+    ]
+
+
+def test_only_the_requested_paths_are_returned():
+    data = json.dumps({"items": [{"id": "1"}], "data": {"other": {"items": [1]}, "items": {"items": []}}}).encode()
+
+    assert parse(data, 5) == []
+
+
+def test_an_incomplete_document_is_an_error():
+    data = json.dumps(DOCUMENT).encode()
+
+    with pytest.raises(ValueError):
+        parse(data[:-20], 16)
@@ -0,0 +1,99 @@
+import sqlite3
+import time
+
+import pytest
+
+from filter_rules import FilterRules
+from ledger import CLAIMED, CODE_PENDING, CODE_RETRIEVED, DONE, NEEDS_LINK, SKIPPED_PUBLISHER, Ledger, is_settled
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = Ledger(str(tmp_path / "primelooter.db"))
+    yield ledger
+    ledger.close()
+
+
+@pytest.mark.parametrize(
+    "entry, settled",
+    [
+        (None, False),
+        ((CLAIMED, None), True),
+        ((CODE_RETRIEVED, "Mock Publisher 1"), True),
+        ((NEEDS_LINK, "Mock Publisher 1"), False),
+        ((SKIPPED_PUBLISHER, "Mock Publisher 2"), True),
+        # Added to publishers.txt since it was skipped
+        ((SKIPPED_PUBLISHER, "Mock Publisher 1"), False),
+    ],
+)
+def test_is_settled(entry, settled):
+    assert is_settled(entry, FilterRules(["Mock Publisher 1"])) is settled
+
+
+def test_a_retrieved_code_is_not_overwritten(ledger):
+    ledger.record("account", "offer-1", CODE_RETRIEVED, "Mock Loot 1", "Mock Publisher 1")
+    ledger.record("account", "offer-1", CLAIMED)
+    ledger.record("account", "offer-2", SKIPPED_PUBLISHER, "Mock Loot 2", "Mock Publisher 2")
+    ledger.record("account", "offer-2", CLAIMED)
+
+    assert ledger.states("account") == {
+        "offer-1": (CODE_RETRIEVED, "Mock Publisher 1"),
+        "offer-2": (CLAIMED, "Mock Publisher 2"),
+    }
+    assert ledger.states("other account") == {}
+
+
+def test_checkpoints_survive_reopening(ledger, tmp_path):
+    ledger.set_checkpoint("account", "offer-1", DONE)
+    ledger.set_checkpoint("account", "offer-2", CODE_PENDING)
+    ledger.set_checkpoint("other account", "offer-1", CODE_PENDING)
+
+    # Committed right away, without commit() or close()
+    reopened = Ledger(str(tmp_path / "primelooter.db"))
+    try:
+        assert reopened.checkpoint("account") == {"offer-1": DONE, "offer-2": CODE_PENDING}
+    finally:
+        reopened.close()
+
+
+def test_old_checkpoints_only_keep_pending_codes(ledger, monkeypatch):
+    ledger.set_checkpoint("account", "offer-1", DONE)
+    ledger.set_checkpoint("account", "offer-2", CODE_PENDING)
+
+    monkeypatch.setattr(time, "time", lambda now=time.time(): now + 3600)
+    assert ledger.checkpoint("account", max_age=7200) == {"offer-1": DONE, "offer-2": CODE_PENDING}
+    assert ledger.checkpoint("account", max_age=60) == {"offer-2": CODE_PENDING}
+
+
+def test_clearing_checkpoints_keeps_the_given_offers(ledger):
+    for offer_id in ("offer-1", "offer-2", "offer-3"):
+        ledger.set_checkpoint("account", offer_id, CODE_PENDING)
+    ledger.set_checkpoint("other account", "offer-1", DONE)
+
+    ledger.clear_checkpoint("account", keep=["offer-2"])
+    assert ledger.checkpoint("account") == {"offer-2": CODE_PENDING}
+    assert ledger.checkpoint("other account") == {"offer-1": DONE}
+
+    ledger.clear_checkpoint("account")
+    assert ledger.checkpoint("account") == {}
+
+
+def test_fingerprints_keep_the_unclaimed_ends(ledger):
+    ledger.set_fingerprint("account", "abc", [2000.0, 1000.0])
+    assert ledger.fingerprint("account", 60) == ("abc", [1000.0, 2000.0])
+    assert ledger.fingerprint("other account", 60) is None
+
+
+def test_fingerprints_of_older_ledgers_are_read(tmp_path):
+    path = str(tmp_path / "old.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE fingerprints (account TEXT PRIMARY KEY, fingerprint TEXT, updated REAL NOT NULL)")
+    db.execute("INSERT INTO fingerprints VALUES ('account', 'abc', ?)", (time.time(),))
+    db.commit()
+    db.close()
+
+    ledger = Ledger(path)
+    try:
+        assert ledger.fingerprint("account", 60) == ("abc", [])
+    finally:
+        ledger.close()
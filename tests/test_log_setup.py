@@ -0,0 +1,26 @@
+import json
+import logging
+
+from log_setup import setup_logging
+
+
+def test_json_log_keeps_the_traceback(tmp_path):
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    log_file = tmp_path / "primelooter.log"
+
+    listener = setup_logging("json", str(log_file))
+    try:
+        try:
+            raise ValueError("broken offer")
+        except ValueError:
+            logging.getLogger().exception("Claim error")
+    finally:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        root.handlers[:], root.level = handlers, level
+
+    (entry,) = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+    assert entry["message"] == "Claim error"
+    assert "ValueError: broken offer" in entry["exception"]
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+import api
+import metrics
+
+
+def test_listing_falls_back_to_one_page_without_cursor_paging(mock, run_looter):
+    mock.paging = False
+
+    run_looter()
+    assert not api.cursor_paging
+    assert metrics.run.counters_by("requests", "operation").get("OffersContext_Offers_And_Items:single") == 2
+    (claims,) = mock.accounts.values()
+    assert len(claims) == len(mock.items)
+
+    # Once turned down, the paged query isn't tried again
+    invalid = mock.requests["invalid"]
+    run_looter(incremental=False)
+    assert mock.requests["invalid"] == invalid
+
+
+@pytest.mark.parametrize(
+    "status, response",
+    [
+        (200, {"data": None, "errors": [{"message": "Rate exceeded", "extensions": {"code": "THROTTLED"}}]}),
+        (200, {"data": None, "errors": [{"message": "Unauthorized"}]}),
+        (400, {"errors": [{"message": "Invalid csrf-token"}]}),
+        (400, "Bad Request"),
+    ],
+)
+def test_other_listing_errors_fail_without_giving_up_paging(mock, run_looter, monkeypatch, status, response):
+    handle = mock.handle
+
+    async def failing_listings(method, path, headers, body):
+        if b"OffersContext_Offers_And_Items" in body:
+            content = response if isinstance(response, str) else json.dumps(response)
+            return status, {"Content-Type": "application/json"}, content.encode()
+        return await handle(method, path, headers, body)
+
+    monkeypatch.setattr(mock, "handle", failing_listings)
+    with pytest.raises(Exception):
+        run_looter(probe=False)
+    assert api.cursor_paging
+    assert "OffersContext_Offers_And_Items:single" not in metrics.run.counters_by("requests", "operation")
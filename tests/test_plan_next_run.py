@@ -0,0 +1,65 @@
+import random
+import time
+
+import pytest
+
+from api import RunSummary
+from primelooter import plan_next_run
+
+NOW = 1_700_000_000.0
+MINUTE = 60
+ARG = {"min_interval": 5, "max_interval": 240, "jitter": 0, "pre_expiry": 60}
+
+
+def summary(next_start=None, unclaimed_ends=(), failed=0, deferred=0) -> RunSummary:
+    result = RunSummary()
+    result.next_start = next_start
+    result.unclaimed_ends = list(unclaimed_ends)
+    result.failed = failed
+    result.deferred = deferred
+    return result
+
+
+@pytest.fixture
+def fixed_clock(monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: NOW)
+    # The most jitter there can be
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+
+
+@pytest.mark.parametrize(
+    "run, arg, wake",
+    [
+        # Nothing planned: the longest interval
+        (summary(), {}, NOW + 240 * MINUTE),
+        (summary(), {"max_interval": 30}, NOW + 30 * MINUTE),
+        # A minute after the next drop goes live, but never sooner than the shortest interval
+        (summary(next_start=NOW + 20 * MINUTE), {}, NOW + 21 * MINUTE),
+        (summary(next_start=NOW + 2 * MINUTE), {}, NOW + 5 * MINUTE),
+        (summary(next_start=NOW + 300 * MINUTE), {}, NOW + 240 * MINUTE),
+        # Failed and deferred offers are retried as soon as allowed
+        (summary(failed=1), {}, NOW + 5 * MINUTE),
+        (summary(deferred=3), {"min_interval": 1}, NOW + 1 * MINUTE),
+        # One more try --pre-expiry minutes before an unclaimed offer ends, unless that is already past
+        (summary(unclaimed_ends=[NOW + 180 * MINUTE, NOW + 120 * MINUTE]), {}, NOW + 60 * MINUTE),
+        (summary(unclaimed_ends=[NOW + 30 * MINUTE]), {}, NOW + 240 * MINUTE),
+        (summary(unclaimed_ends=[NOW + 30 * MINUTE]), {"pre_expiry": 20}, NOW + 10 * MINUTE),
+        # Whatever comes first
+        (summary(next_start=NOW + 50 * MINUTE, unclaimed_ends=[NOW + 100 * MINUTE]), {}, NOW + 40 * MINUTE),
+        # Jitter is added on top of everything
+        (summary(failed=1), {"jitter": 5}, NOW + 10 * MINUTE),
+    ],
+)
+def test_plan_next_run(fixed_clock, run, arg, wake):
+    assert plan_next_run(run, dict(ARG, **arg)) == wake
+
+
+def test_a_skipped_run_still_plans_the_pre_expiry_retry(mock, run_looter):
+    # Offers needing an account link stay unclaimed, the probe skips the next run
+    mock.items = {asset_id: (item, index % 4 == 0) for index, (asset_id, (item, _)) in enumerate(mock.items.items())}
+    first = run_looter()
+    skipped = run_looter()
+    assert first.unclaimed_ends
+
+    arg = dict(ARG, max_interval=60 * 24 * 30)
+    assert plan_next_run(skipped, arg) == min(first.unclaimed_ends) - 60 * MINUTE
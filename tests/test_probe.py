@@ -0,0 +1,52 @@
+import metrics
+
+
+def listed(label="OffersContext_Offers_And_Items") -> float:
+    return metrics.run.counters_by("requests", "operation").get(label, 0)
+
+
+def needing_a_link(mock):
+    mock.items = {asset_id: (item, index % 4 == 0) for index, (asset_id, (item, _)) in enumerate(mock.items.items())}
+
+
+def test_unchanged_runs_are_skipped_despite_offers_needing_a_link(mock, run_looter):
+    needing_a_link(mock)
+
+    summary = run_looter()
+    assert listed() > 0
+    assert summary.unclaimed_ends and not summary.failed
+
+    # The skipped run still reports the unclaimed offers, so their pre-expiry retry stays planned
+    skipped = run_looter()
+    assert listed() == 0
+    assert listed("OffersContext_Offers_And_Items:probe") > 0
+    assert sorted(skipped.unclaimed_ends) == sorted(summary.unclaimed_ends)
+
+
+def test_runs_are_not_skipped_when_a_pre_expiry_retry_is_due(mock, run_looter):
+    needing_a_link(mock)
+    run_looter()
+
+    # The mock's offers end in 7-8 days, all of them are within this window
+    run_looter(pre_expiry=60 * 60 * 24 * 10)
+    assert listed() > 0
+
+
+def test_runs_with_failed_offers_are_not_skipped(mock, run_looter, monkeypatch):
+    place_orders = mock.place_orders
+
+    def failing_place_orders(body, claims):
+        if body["variables"]["input"]["offerIds"] == "loot-offer-1":
+            return {"data": {"placeOrders": {"error": {"code": "CLAIM_FAILED"}}}}
+        return place_orders(body, claims)
+
+    monkeypatch.setattr(mock, "place_orders", failing_place_orders)
+    assert run_looter().failed == 1
+
+    monkeypatch.setattr(mock, "place_orders", place_orders)
+    summary = run_looter()
+    assert listed() > 0
+    assert not summary.failed
+
+    run_looter()
+    assert listed() == 0